@@ -0,0 +1,77 @@
+"""
+Benchmark for `cellenics account create-users-list`, against an in-memory
+Cognito user pool provided by moto.
+
+    python benchmarks/bench_accounts.py --users 10,100,500
+"""
+
+import csv
+import os
+import tempfile
+from pathlib import Path
+
+import boto3
+import click
+from harness import measure, parse_sizes, print_table, quiet, summarize
+from moto import mock_aws
+
+from cellenics.account import account
+from cellenics.utils.constants import STAGING
+
+REGION = "us-east-1"
+
+
+def _write_user_list(path, num_users):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        for i in range(num_users):
+            writer.writerow([f"User {i}", f"user{i}@example.com"])
+
+
+@click.command()
+@click.option(
+    "--users",
+    default="10,100,500",
+    show_default=True,
+    callback=parse_sizes,
+    help="Comma-separated numbers of users per list.",
+)
+@click.option("--repeat", default=3, show_default=True, help="Timed repetitions.")
+def main(users, repeat):
+    # The commands create their sessions from a profile, which sets the region.
+    os.environ.setdefault("AWS_DEFAULT_REGION", REGION)
+
+    rows = []
+
+    with mock_aws(), tempfile.TemporaryDirectory() as tmp:
+        cognito = boto3.client("cognito-idp", region_name=REGION)
+
+        def new_user_pool():
+            # Every repetition creates the same users, so each gets a new pool.
+            pool = cognito.create_user_pool(PoolName="biomage-user-pool-staging")
+            account.COGNITO_STAGING_POOL = pool["UserPool"]["Id"]
+
+        for num_users in users:
+            user_list = str(Path(tmp) / f"users-{num_users}.csv")
+            _write_user_list(user_list, num_users)
+
+            def create_users():
+                account._create_users_list(user_list, None, STAGING, None, False)
+
+            with quiet():
+                timings = measure(create_users, repeat, setup=new_user_pool)
+
+            best, median = summarize(timings)
+            rows.append(
+                (num_users, best, median, num_users / best, best / num_users * 1e3)
+            )
+
+    print_table(
+        f"Bulk account creation (best of {repeat})",
+        rows,
+        ["USERS", "BEST (s)", "MEDIAN (s)", "USERS/s", "PER USER (ms)"],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Benchmark for the `AuroraClient.select` queries made by `cellenics experiment`,
+against a local Postgres such as the one in inframock.
+
+The tables the queries read are created and seeded with synthetic experiments
+in a separate `cellenics_benchmark` schema, which is dropped afterwards. The
+benchmark is skipped if `psql` is not installed or Postgres is not reachable.
+
+    python benchmarks/bench_aurora.py --samples 10,100,1000
+"""
+
+import os
+import shutil
+
+import click
+from harness import measure, parse_sizes, print_table, quiet, summarize
+
+from cellenics.experiment.download import _get_samples
+from cellenics.experiment.info import _get_experiment_runs, _get_experiment_samples
+from cellenics.utils.AuroraClient import AuroraClient
+from cellenics.utils.constants import DEVELOPMENT
+
+SCHEMA = "cellenics_benchmark"
+
+SAMPLE_FILE_TYPES = "ARRAY['features10x', 'matrix10x', 'barcodes10x']"
+
+CREATE_SCHEMA = f"""
+DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;
+CREATE SCHEMA {SCHEMA};
+CREATE TABLE {SCHEMA}.sample (
+    id text PRIMARY KEY,
+    experiment_id text NOT NULL,
+    name text NOT NULL,
+    sample_technology text NOT NULL,
+    options jsonb NOT NULL
+);
+CREATE INDEX ON {SCHEMA}.sample (experiment_id);
+CREATE TABLE {SCHEMA}.sample_file (
+    id text PRIMARY KEY,
+    sample_file_type text NOT NULL,
+    s3_path text NOT NULL
+);
+CREATE TABLE {SCHEMA}.sample_to_sample_file_map (
+    sample_id text NOT NULL REFERENCES {SCHEMA}.sample (id),
+    sample_file_id text NOT NULL REFERENCES {SCHEMA}.sample_file (id)
+);
+CREATE INDEX ON {SCHEMA}.sample_to_sample_file_map (sample_id);
+CREATE TABLE {SCHEMA}.experiment_execution (
+    experiment_id text NOT NULL,
+    pipeline_type text NOT NULL,
+    state_machine_arn text NOT NULL,
+    execution_arn text NOT NULL,
+    last_status_response jsonb NOT NULL
+);
+CREATE INDEX ON {SCHEMA}.experiment_execution (experiment_id);
+"""
+
+SEED_EXPERIMENT = """
+INSERT INTO {schema}.sample
+    SELECT '{experiment_id}-' || i, '{experiment_id}', 'Sample ' || i, '10x', '{{}}'
+    FROM generate_series(1, {num_samples}) i;
+INSERT INTO {schema}.sample_file
+    SELECT '{experiment_id}-' || i || '-' || t, t, '{experiment_id}/' || i || '/' || t
+    FROM generate_series(1, {num_samples}) i, unnest({file_types}) t;
+INSERT INTO {schema}.sample_to_sample_file_map
+    SELECT '{experiment_id}-' || i, '{experiment_id}-' || i || '-' || t
+    FROM generate_series(1, {num_samples}) i, unnest({file_types}) t;
+INSERT INTO {schema}.experiment_execution
+    SELECT '{experiment_id}', p, 'arn:' || p, 'arn:' || p || ':1', '{{}}'
+    FROM unnest(ARRAY['gem2s', 'qc']) p;
+ANALYZE;
+"""
+
+
+def _run_sql(client, sql):
+    client.run_query(f'psql -v ON_ERROR_STOP=1 -c "{sql}"', verbose=False)
+
+
+@click.command()
+@click.option(
+    "--samples",
+    default="10,100,1000",
+    show_default=True,
+    callback=parse_sizes,
+    help="Comma-separated numbers of samples per experiment.",
+)
+@click.option("--repeat", default=10, show_default=True, help="Timed repetitions.")
+@click.option(
+    "--local_port",
+    default=5431,
+    show_default=True,
+    help="Port Postgres is listening on.",
+)
+@click.option(
+    "--user", default="dev_role", show_default=True, help="User to connect as."
+)
+def main(samples, repeat, local_port, user):
+    if not shutil.which("psql"):
+        click.echo(click.style("psql is not installed, skipping.", fg="yellow"))
+        return
+
+    # Queries are unqualified, as in the commands, so they resolve to the
+    # benchmark schema instead of any real data in the same database.
+    os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+
+    client = AuroraClient(
+        "default", user, "us-east-1", DEVELOPMENT, None, local_port=local_port
+    )
+
+    try:
+        _run_sql(client, CREATE_SCHEMA)
+    except Exception as e:
+        click.echo(
+            click.style(
+                f"Could not set up Postgres on port {local_port}, skipping: {e}",
+                fg="yellow",
+            )
+        )
+        return
+
+    rows = []
+
+    try:
+        for num_samples in samples:
+            experiment_id = f"experiment-{num_samples}"
+
+            _run_sql(
+                client,
+                SEED_EXPERIMENT.format(
+                    schema=SCHEMA,
+                    experiment_id=experiment_id,
+                    num_samples=num_samples,
+                    file_types=SAMPLE_FILE_TYPES,
+                ),
+            )
+
+            queries = {
+                "download: samples and files": lambda: _get_samples(
+                    experiment_id, client
+                ),
+                "info: samples": lambda: _get_experiment_samples(client, experiment_id),
+                "info: pipeline runs": lambda: _get_experiment_runs(
+                    client, experiment_id
+                ),
+            }
+
+            for name, query in queries.items():
+                with quiet():
+                    best, median = summarize(measure(query, repeat))
+
+                rows.append(
+                    (name, num_samples, best * 1e3, median * 1e3, num_samples / best)
+                )
+    finally:
+        _run_sql(client, f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+
+    print_table(
+        f"AuroraClient.select (best of {repeat})",
+        rows,
+        ["QUERY", "SAMPLES", "BEST (ms)", "MEDIAN (ms)", "SAMPLES/s"],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Microbenchmark for the encryption of GitHub secrets during `cellenics rotate-ci`.
+
+Each repository has its own public key and gets three secrets. This compares
+parsing the key for every value (as `encrypt` used to) with `encrypt`, which
+caches the sealed box per key, and with `encrypt_all`, which encrypts the three
+values in one call.
+
+    python benchmarks/bench_encrypt.py --repos 100
+"""
+
+import timeit
+from base64 import b64encode
+
+import click
+from nacl import encoding, public
+
+from cellenics.utils.encrypt import _get_sealed_box, encrypt, encrypt_all
+
+SECRET_NAMES = ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "API_TOKEN_GITHUB")
+
+
+def _encrypt_without_cache(public_key, secret_value):
+    public_key = public.PublicKey(public_key.encode("utf-8"), encoding.Base64Encoder())
+    sealed_box = public.SealedBox(public_key)
+    encrypted = sealed_box.encrypt(secret_value.encode("utf-8"))
+    return b64encode(encrypted).decode("utf-8")
+
+
+def _generate_public_keys(num_repos):
+    return [
+        public.PrivateKey.generate()
+        .public_key.encode(encoding.Base64Encoder())
+        .decode("utf-8")
+        for _ in range(num_repos)
+    ]
+
+
+@click.command()
+@click.option("--repos", default=100, show_default=True, help="Repositories.")
+@click.option("--repeat", default=5, show_default=True, help="Timed repetitions.")
+def main(repos, repeat):
+    public_keys = _generate_public_keys(repos)
+    secrets = {name: "x" * 40 for name in SECRET_NAMES}
+
+    def one_by_one(encrypt_fn):
+        for public_key in public_keys:
+            for value in secrets.values():
+                encrypt_fn(public_key, value)
+
+    def batched():
+        for public_key in public_keys:
+            encrypt_all(public_key, secrets)
+
+    cases = {
+        "encrypt (key parsed per value)": lambda: one_by_one(_encrypt_without_cache),
+        "encrypt (sealed box cached)": lambda: one_by_one(encrypt),
+        "encrypt_all": batched,
+    }
+
+    click.echo(f"{repos} repositories, {len(secrets)} secrets each")
+    click.echo("{0:<35}{1:>12}{2:>16}".format("CASE", "BEST (ms)", "PER SECRET (µs)"))
+
+    for name, case in cases.items():
+        timings = []
+
+        # Every repetition starts cold, the same as a fresh `rotate-ci` run.
+        for _ in range(repeat):
+            _get_sealed_box.cache_clear()
+            timings.append(timeit.timeit(case, number=1))
+
+        best = min(timings)
+        per_secret = best / (repos * len(secrets)) * 1e6
+
+        click.echo(f"{name:<35}{best * 1e3:>12.2f}{per_secret:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark for the repository scan of `cellenics rotate-ci`, which finds the
+repositories that need CI credentials and their IAM policies, against a fake
+GitHub GraphQL API served locally.
+
+Scans are measured cold, with an empty cache, and warm, when all CI files are
+unchanged since the previous scan.
+
+    python benchmarks/bench_rotate_ci.py --repos 10,100,500 --latency 50
+"""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+from harness import measure, parse_sizes, print_table, summarize
+
+ORG = "hms-dbmi-cellenics"
+
+CI_FILE = """\
+ci-policies:
+  - arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess
+  - arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryPowerUser
+"""
+
+Repo = namedtuple("Repo", ["name", "archived"])
+
+
+class FakeGitHub(BaseHTTPRequestHandler):
+    """
+    Answers the GraphQL queries of `rotate-ci` as if every other repository had
+    a CI file, after waiting the configured network latency.
+    """
+
+    latency = 0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        with FakeGitHub.lock:
+            FakeGitHub.requests += 1
+
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with_text = "text" in body["query"]
+
+        data = {}
+        for alias, name in body["variables"].items():
+            if not re.fullmatch(r"n\d+", alias):
+                continue
+
+            number = int(name.split("-")[-1])
+            blob = {"oid": f"{number:040x}"}
+            if with_text:
+                blob["text"] = CI_FILE
+
+            data[f"r{alias[1:]}"] = {
+                "f0": blob if number % 2 == 0 else None,
+                "f1": None,
+            }
+
+        response = json.dumps({"data": data}).encode()
+
+        time.sleep(self.latency / 1000)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+@click.command()
+@click.option(
+    "--repos",
+    default="10,100,500",
+    show_default=True,
+    callback=parse_sizes,
+    help="Comma-separated numbers of repositories in the organization.",
+)
+@click.option(
+    "--latency",
+    default=50,
+    show_default=True,
+    help="Simulated GitHub response time, in milliseconds.",
+)
+@click.option("--repeat", default=3, show_default=True, help="Timed repetitions.")
+def main(repos, latency, repeat):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    FakeGitHub.latency = latency
+
+    cache_path = tempfile.mkdtemp()
+
+    # Both are read when the modules are imported.
+    os.environ["GITHUB_API_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ["CELLENICS_CACHE_PATH"] = cache_path
+
+    from cellenics.rotate_ci.rotate_ci import filter_iam_repos
+
+    def clear_cache():
+        shutil.rmtree(cache_path, ignore_errors=True)
+
+    rows = []
+
+    try:
+        for num_repos in repos:
+            org_repos = [Repo(f"repo-{i}", False) for i in range(num_repos)]
+
+            def scan():
+                filter_iam_repos(org_repos, "token", ORG)
+
+            for case, setup in (("cold", clear_cache), ("warm", None)):
+                FakeGitHub.requests = 0
+
+                best, median = summarize(measure(scan, repeat, setup=setup))
+                rows.append(
+                    (
+                        case,
+                        num_repos,
+                        FakeGitHub.requests // repeat,
+                        best,
+                        median,
+                        num_repos / best,
+                    )
+                )
+    finally:
+        server.shutdown()
+        clear_cache()
+
+    print_table(
+        f"rotate-ci repository scan ({latency} ms latency, best of {repeat})",
+        rows,
+        ["CACHE", "REPOS", "REQUESTS", "BEST (s)", "MEDIAN (s)", "REPOS/s"],
+    )
+
+
+if __name__ == "__main__":
+    main()
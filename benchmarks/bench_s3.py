@@ -0,0 +1,146 @@
+"""
+Benchmark for `cellenics experiment download` and `upload` of raw RDS files,
+against an in-memory S3 provided by moto.
+
+Sample lookups, which normally go through Aurora, are answered from memory so
+only the S3 transfers are measured.
+
+    python benchmarks/bench_s3.py --samples 1,10,50 --file_size 4
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+import boto3
+import click
+from harness import measure, parse_sizes, print_table, quiet, summarize
+from moto import mock_aws
+
+from cellenics.experiment.download import _download_raw_rds_files
+from cellenics.experiment.upload import _upload_raw_rds_files
+from cellenics.utils.constants import RAW_FILES_BUCKET
+
+ACCOUNT_ID = "123456789012"
+ENVIRONMENT = "staging"
+REGION = "us-east-1"
+
+BUCKET = f"{RAW_FILES_BUCKET}-{ENVIRONMENT}-{ACCOUNT_ID}"
+
+
+class SampleList:
+    """
+    Stands in for an `AuroraClient` that only ever lists an experiment's samples.
+    """
+
+    def __init__(self, num_samples):
+        self.samples = [
+            {"sample_id": f"sample-{i}", "sample_name": f"Sample {i}"}
+            for i in range(num_samples)
+        ]
+
+    def select(self, query):
+        return self.samples
+
+
+def _populate_bucket(s3, experiment_id, num_samples, content):
+    for i in range(num_samples):
+        s3.put_object(
+            Bucket=BUCKET, Key=f"{experiment_id}/sample-{i}/r.rds", Body=content
+        )
+
+
+def _populate_folder(input_path, experiment_id, num_samples, content):
+    for i in range(num_samples):
+        sample_path = input_path / experiment_id / "raw" / f"sample-{i}"
+        sample_path.mkdir(parents=True)
+        (sample_path / "r.rds").write_bytes(content)
+
+
+@click.command()
+@click.option(
+    "--samples",
+    default="1,10,50",
+    show_default=True,
+    callback=parse_sizes,
+    help="Comma-separated numbers of samples per experiment.",
+)
+@click.option(
+    "--file_size", default=4, show_default=True, help="Size of each file in MiB."
+)
+@click.option("--repeat", default=3, show_default=True, help="Timed repetitions.")
+def main(samples, file_size, repeat):
+    content = os.urandom(file_size * 1024 * 1024)
+    rows = []
+
+    with mock_aws(), tempfile.TemporaryDirectory() as tmp:
+        session = boto3.Session(region_name=REGION)
+        s3 = session.client("s3")
+        s3.create_bucket(Bucket=BUCKET)
+
+        for num_samples in samples:
+            experiment_id = f"experiment-{num_samples}"
+            size = num_samples * file_size
+
+            input_path = Path(tmp) / "upload"
+            _populate_folder(input_path, experiment_id, num_samples, content)
+
+            def upload():
+                _upload_raw_rds_files(
+                    experiment_id,
+                    ENVIRONMENT,
+                    input_path,
+                    True,
+                    session,
+                    ACCOUNT_ID,
+                    None,
+                )
+
+            _populate_bucket(s3, experiment_id, num_samples, content)
+            output_path = Path(tmp) / "download" / experiment_id
+
+            def download():
+                _download_raw_rds_files(
+                    experiment_id,
+                    ENVIRONMENT,
+                    output_path,
+                    True,
+                    False,
+                    session,
+                    ACCOUNT_ID,
+                    SampleList(num_samples),
+                )
+
+            for operation, fn in (("upload", upload), ("download", download)):
+                with quiet():
+                    best, median = summarize(measure(fn, repeat))
+
+                rows.append(
+                    (
+                        operation,
+                        num_samples,
+                        size,
+                        best,
+                        median,
+                        size / best,
+                        best / num_samples * 1e3,
+                    )
+                )
+
+    print_table(
+        f"Raw RDS transfers ({file_size} MiB per sample, best of {repeat})",
+        rows,
+        [
+            "OPERATION",
+            "SAMPLES",
+            "MiB",
+            "BEST (s)",
+            "MEDIAN (s)",
+            "MiB/s",
+            "PER FILE (ms)",
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
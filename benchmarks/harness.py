@@ -0,0 +1,59 @@
+"""
+Helpers shared by the benchmarks in this folder.
+"""
+
+import contextlib
+import io
+import statistics
+import time
+
+import click
+from tabulate import tabulate
+
+
+def parse_sizes(ctx, param, value):
+    try:
+        return [int(size) for size in value.split(",")]
+    except ValueError:
+        raise click.BadParameter("must be a comma-separated list of integers")
+
+
+def measure(fn, repeat, setup=None):
+    """
+    Calls `fn` `repeat` times, each after a call to `setup` if given, and
+    returns how long every call took in seconds.
+    """
+    timings = []
+
+    for _ in range(repeat):
+        if setup:
+            setup()
+
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Silences the progress output of the commands being measured.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        with contextlib.redirect_stderr(io.StringIO()):
+            yield
+
+
+def summarize(timings):
+    """
+    Returns the best and median of `timings`.
+    """
+    return min(timings), statistics.median(timings)
+
+
+def print_table(title, rows, headers):
+    click.echo(click.style(title, bold=True))
+    click.echo(tabulate(rows, headers=headers, floatfmt=".3f"))
+    click.echo()
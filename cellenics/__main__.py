@@ -5,19 +5,37 @@ from cellenics.configure_repo import configure_repo
 from cellenics.experiment import experiment
 from cellenics.rds import rds
 from cellenics.rotate_ci import rotate_ci
+from cellenics.sandboxes import sandboxes
 from cellenics.stage import stage
 from cellenics.unstage import unstage
+from cellenics.utils import tracing
 
 
 @click.group()
-def main():
+@click.option(
+    "--profile",
+    envvar="CELLENICS_TRACE",
+    is_flag=True,
+    help="Print how long boto3 calls, GitHub requests, psql and tunnels took.",
+)
+@click.option(
+    "--trace_file",
+    envvar="CELLENICS_TRACE_FILE",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Also write every timed span to this file, as JSON lines if it ends in "
+    ".jsonl and as a Chrome trace otherwise. Implies --profile.",
+)
+def main(profile, trace_file):
     """🧬 Your one-stop shop for managing Cellenics infrastructure."""
+    if profile or trace_file:
+        tracing.enable(trace_file)
 
 
 main.add_command(configure_repo.configure_repo)
 main.add_command(rotate_ci.rotate_ci)
 main.add_command(stage.stage)
 main.add_command(unstage.unstage)
+main.add_command(sandboxes.sandboxes)
 main.add_command(experiment.experiment)
 main.add_command(account.account)
 main.add_command(rds.rds)
@@ -7,10 +7,10 @@ import time
 from secrets import choice
 
 import biomage_programmatic_interface as bpi
-import boto3
 import click
 import pandas as pd
 
+from ..utils.aws import get_client
 from ..utils.constants import DEFAULT_AWS_PROFILE, PRODUCTION, STAGING
 
 
@@ -40,8 +40,7 @@ def create_account(full_name, email, aws_profile, userpool):
     Creates a new account with the information provided.
     Requires a password change call afterwards."""
 
-    session = boto3.Session(profile_name=aws_profile)
-    cognito = session.client("cognito-idp")
+    cognito = get_client("cognito-idp", aws_profile)
 
     cognito.admin_create_user(
         UserPoolId=userpool,
@@ -95,8 +94,7 @@ def change_password(email, password, aws_profile, userpool):
 
 
 def _change_password(email, password, aws_profile, userpool):
-    session = boto3.Session(profile_name=aws_profile)
-    cognito = session.client("cognito-idp")
+    cognito = get_client("cognito-idp", aws_profile)
 
     cognito.admin_set_user_password(
         UserPoolId=userpool, Username=email, Password=password, Permanent=True
@@ -348,8 +346,7 @@ def create_process_experiment_list(
     print("Creating users from the csv file")
     _create_users_list(user_list, None, "production", aws_profile, allow_exists)
 
-    session = boto3.Session(profile_name=aws_profile)
-    client = session.client("cognito-idp")
+    client = get_client("cognito-idp", aws_profile)
     created_users = pd.read_csv(user_list + ".out", header=None, quoting=csv.QUOTE_ALL)
 
     # creating the experiment and uploading samples
@@ -1,36 +1,121 @@
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+
 import click
-from github import Github
-from github.GithubException import UnknownObjectException
+from github.GithubException import GithubException, UnknownObjectException
 from inquirer import Confirm, prompt
 from inquirer.themes import GreenPassion
 
+from ..utils.github_api import get_github
 
-def configure(r, token):
-    r.edit(
-        private=False,
-        has_issues=False,
-        has_wiki=False,
-        has_projects=False,
-        allow_squash_merge=True,
-        allow_merge_commit=False,
-        allow_rebase_merge=False,
-        delete_branch_on_merge=True,
-        default_branch="master",
+REPO_SETTINGS = {
+    "private": False,
+    "has_issues": False,
+    "has_wiki": False,
+    "has_projects": False,
+    "allow_squash_merge": True,
+    "allow_merge_commit": False,
+    "allow_rebase_merge": False,
+    "delete_branch_on_merge": True,
+    "default_branch": "master",
+}
+
+MAX_WORKERS = 8
+
+
+def _settings_match(r):
+    return all(getattr(r, name) == value for name, value in REPO_SETTINGS.items())
+
+
+def _protection_matches(branch):
+    try:
+        protection = branch.get_protection().raw_data
+    except GithubException:
+        # The branch is not protected at all.
+        return False
+
+    reviews = protection.get("required_pull_request_reviews") or {}
+    status_checks = protection.get("required_status_checks") or {}
+    restrictions = protection.get("restrictions") or {}
+
+    return (
+        reviews.get("required_approving_review_count") == 1
+        and (protection.get("enforce_admins") or {}).get("enabled") is True
+        and status_checks.get("strict") is True
+        and status_checks.get("contexts") == []
+        and restrictions.get("users") == []
+        and restrictions.get("teams") == []
+        and (protection.get("required_signatures") or {}).get("enabled") is True
     )
+
+
+def configure(r, token):
+    """
+    Configures the repository `r` according to convention, only changing what
+    doesn't conform already. Returns True if anything was changed.
+    """
+    changed = False
+
+    if not _settings_match(r):
+        r.edit(**REPO_SETTINGS)
+        changed = True
+
     master = r.get_branch("master")
-    master.edit_protection(
-        user_push_restrictions=[],
-        team_push_restrictions=[],
-        required_approving_review_count=1,
-        enforce_admins=True,
-        strict=True,
-        contexts=[],
+
+    if not _protection_matches(master):
+        master.edit_protection(
+            user_push_restrictions=[],
+            team_push_restrictions=[],
+            required_approving_review_count=1,
+            enforce_admins=True,
+            strict=True,
+            contexts=[],
+        )
+        master.add_required_signatures()
+        changed = True
+
+    return changed
+
+
+def _create_repo(o, name, create):
+    if create:
+        click.echo(f"Repository {name} does not exist, creating...")
+    else:
+        questions = [
+            Confirm(
+                name="create",
+                message=f"""Repository {name} does not exist.
+                Do you want to create it?""",
+            )
+        ]
+
+        answer = prompt(questions, theme=GreenPassion())
+
+        if not answer["create"]:
+            exit(1)
+
+    o.create_repo(name)
+    click.echo(f"✔️ {name} created.")
+    click.echo(
+        "✔️ Push something to `master` and re-run this utility to set "
+        "everything up appropriately."
     )
-    master.add_required_signatures()
+
+
+def _is_pattern(name):
+    return any(char in name for char in "*?[")
 
 
 @click.command()
-@click.argument("name")
+@click.argument("names", nargs=-1)
+@click.option(
+    "--all",
+    "-a",
+    "all_repos",
+    is_flag=True,
+    show_default=True,
+    help="Configure all repositories in the organization that are not archived.",
+)
 @click.option(
     "--create",
     "-c",
@@ -53,43 +138,65 @@ def configure(r, token):
     show_default=True,
     help="The GitHub organization to perform the operation in.",
 )
-def configure_repo(name, token, create, org):
+def configure_repo(names, all_repos, token, create, org):
     """
-    Configures a repository to conform to standards.
+    Configures repositories to conform to standards.
+
+    NAMES can be repository names or shell-style patterns matched against the
+    repositories in the organization that are not archived, e.g.:
+
+        cellenics configure-repo ui api 'pipeline*'
     """
 
-    g = Github(token)
+    if not names and not all_repos:
+        raise click.UsageError("Supply at least one repository name or use --all.")
+
+    g = get_github(token)
     o = g.get_organization(org)
 
     click.echo(f"Successfully logged into organization {o.name} ({o.login}).")
 
-    try:
-        r = o.get_repo(name)
-    except UnknownObjectException:
-        if create:
-            click.echo(f"Repository {name} does not exist, creating...")
-        else:
-            questions = [
-                Confirm(
-                    name="create",
-                    message=f"""Repository {name} does not exist.
-                    Do you want to create it?""",
-                )
-            ]
-
-            answer = prompt(questions, theme=GreenPassion())
-
-            if not answer["create"]:
-                exit(1)
-
-        r = o.create_repo(name)
-        click.echo(f"✔️ {name} created.")
-        click.echo(
-            "✔️ Push something to `master` and re-run this utility to set "
-            "everything up appropriately."
-        )
-        exit(0)
+    patterns = [name for name in names if _is_pattern(name)]
+    repos = {}
+
+    if all_repos or patterns:
+        for r in o.get_repos():
+            if r.archived:
+                continue
+
+            if all_repos or any(fnmatch(r.name, pattern) for pattern in patterns):
+                repos[r.name] = r
+
+    for name in names:
+        if _is_pattern(name) or name in repos:
+            continue
 
-    configure(r, token)
+        try:
+            repos[name] = o.get_repo(name)
+        except UnknownObjectException:
+            _create_repo(o, name, create)
+
+    # Repositories are only changed where they don't already conform, so most
+    # of this is read-only.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            name: executor.submit(configure, r, token) for name, r in repos.items()
+        }
+
+    failed = False
+
+    for name, future in futures.items():
+        try:
+            changed = future.result()
+        except GithubException as e:
+            click.echo(click.style(f"✖️ Could not configure {name}: {e}", fg="red"))
+            failed = True
+            continue
+
+        if changed:
+            click.echo(f"✔️ Successfully configured {name} according to convention.")
+        else:
+            click.echo(f"✔️ {name} already conforms to convention.")
 
-    click.echo(f"✔️ Successfully configured {name} according to convention.")
+    if failed:
+        exit(1)
@@ -2,10 +2,10 @@ import json
 import os
 from pathlib import Path
 
-import boto3
 import click
 
 from ..utils.AuroraClient import AuroraClient
+from ..utils.aws import get_identity, get_session, get_session_client
 from ..utils.constants import (
     CELLSETS_BUCKET,
     DEFAULT_AWS_PROFILE,
@@ -15,6 +15,9 @@ from ..utils.constants import (
     SAMPLES_BUCKET,
     STAGING,
 )
+from ..utils.throttle import parse_size
+from ..utils.tracing import traced
+from ..utils.transfer import get_transfer_metrics, limit_transfers
 
 SAMPLES = "samples"
 RAW_FILE = "raw_rds"
@@ -37,36 +40,45 @@ file_type_to_name_map = {
 DATA_LOCATION = os.getenv("CELLENICS_DATA_PATH", "./data")
 
 
-# Copied from https://stackoverflow.com/a/62945526
+# Adapted from https://stackoverflow.com/a/62945526
+@traced("s3")
 def _download_folder(bucket_name, s3_path, local_folder_path, boto3_session):
-    s3 = boto3_session.resource("s3")
-    bucket = s3.Bucket(bucket_name)
+    s3 = get_session_client(boto3_session, "s3")
+    paginator = s3.get_paginator("list_objects_v2")
 
-    for object in bucket.objects.filter(Prefix=s3_path):
-        # Join local path with subsequent s3 path
-        local_file_path = os.path.join(
-            local_folder_path, os.path.relpath(object.key, s3_path)
-        )
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=s3_path):
+        for object in page.get("Contents", []):
+            key = object["Key"]
 
-        # Create local folder
-        if not os.path.exists(os.path.dirname(local_file_path)):
-            os.makedirs(os.path.dirname(local_file_path))
+            # Join local path with subsequent s3 path
+            local_file_path = os.path.join(
+                local_folder_path, os.path.relpath(key, s3_path)
+            )
 
-        if object.key[-1] == "/":
-            continue
+            # Create local folder
+            if not os.path.exists(os.path.dirname(local_file_path)):
+                os.makedirs(os.path.dirname(local_file_path))
 
-        print(f"Downloading {object.key}")
+            if key[-1] == "/":
+                continue
 
-        bucket.download_file(object.key, local_file_path)
+            with get_transfer_metrics().track(
+                "download", bucket_name, key, object["Size"]
+            ) as callback:
+                s3.download_file(bucket_name, key, local_file_path, Callback=callback)
 
 
-def _download_file(bucket, s3_path, local_file_path, boto3_session):
-    s3 = boto3_session.resource("s3")
+@traced("s3")
+def _download_file(bucket, s3_path, local_file_path, boto3_session, size=None):
+    s3 = get_session_client(boto3_session, "s3")
 
     local_file_path.parent.mkdir(parents=True, exist_ok=True)
 
-    s3_obj = s3.Object(bucket, s3_path)
-    s3_obj.download_file(str(local_file_path))
+    if size is None:
+        size = s3.head_object(Bucket=bucket, Key=s3_path)["ContentLength"]
+
+    with get_transfer_metrics().track("download", bucket, s3_path, size) as callback:
+        s3.download_file(bucket, s3_path, str(local_file_path), Callback=callback)
 
 
 def _create_sample_mapping(samples_list, output_path):
@@ -178,9 +190,11 @@ def _download_samples(
 
             print(f"> Downloading {s3_path} (file {file_idx+1}/{num_files})")
 
-            s3client = boto3_session.client("s3")
-            s3client.head_object(Bucket=bucket, Key=s3_path)
-            _download_file(bucket, s3_path, file_path, boto3_session)
+            s3client = get_session_client(boto3_session, "s3")
+            head = s3client.head_object(Bucket=bucket, Key=s3_path)
+            _download_file(
+                bucket, s3_path, file_path, boto3_session, size=head["ContentLength"]
+            )
 
         print(f"Sample {sample_name} downloaded.\n")
 
@@ -246,9 +260,11 @@ def _download_raw_rds_files(
 
         print(f"Downloading {file_name} ({sample_idx+1}/{num_samples})")
 
-        s3client = boto3_session.client("s3")
-        s3client.head_object(Bucket=bucket, Key=s3_path)
-        _download_file(bucket, s3_path, file_path, boto3_session)
+        s3client = get_session_client(boto3_session, "s3")
+        head = s3client.head_object(Bucket=bucket, Key=s3_path)
+        _download_file(
+            bucket, s3_path, file_path, boto3_session, size=head["ContentLength"]
+        )
 
         print(f"Sample {sample['sample_name']} downloaded.\n")
 
@@ -285,7 +301,7 @@ def _download_filtered_cells(
     bucket = f"{FILTERED_CELLS_BUCKET}-{input_env}-{aws_account_id}"
     end_message = "Filtered cells files have been downloaded."
 
-    s3client = boto3_session.client("s3")
+    s3client = get_session_client(boto3_session, "s3")
 
     paginator = s3client.get_paginator("list_objects")
     operation_parameters = {"Bucket": bucket, "Prefix": experiment_id}
@@ -296,7 +312,7 @@ def _download_filtered_cells(
         for file in page["Contents"]:
             key = file["Key"]
             file_path = output_path / key.replace(experiment_id, "filtered-cells")
-            _download_file(bucket, key, file_path, boto3_session)
+            _download_file(bucket, key, file_path, boto3_session, size=file["Size"])
             print(f"RDS file saved to {file_path}")
 
     click.echo(click.style(f"{end_message}", fg="green"))
@@ -387,6 +403,29 @@ def _download_cellsets(
     show_default=True,
     help="The name of the profile stored in ~/.aws/credentials to use.",
 )
+@click.option(
+    "--metrics_file",
+    required=False,
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write a JSON summary of the transfers, with throughput per bucket.",
+)
+@click.option(
+    "--max_bandwidth",
+    envvar="CELLENICS_MAX_BANDWIDTH",
+    required=False,
+    default=None,
+    callback=parse_size,
+    help="Limit S3 transfers to this many bytes per second, e.g. 500K or 10M.",
+)
+@click.option(
+    "--max_requests",
+    envvar="CELLENICS_MAX_REQUESTS",
+    required=False,
+    default=None,
+    type=float,
+    help="Limit S3 requests to this many per second.",
+)
 def download(
     experiment_id,
     input_env,
@@ -396,6 +435,9 @@ def download(
     name_with_id,
     without_tunnel,
     aws_profile,
+    metrics_file,
+    max_bandwidth,
+    max_requests,
 ):
     """
     Downloads files associated with an experiment from a given environment.\n
@@ -407,9 +449,15 @@ def download(
     -f samples -f cellsets -o output/folder
     """
 
-    boto3_session = boto3.Session(profile_name=aws_profile)
-    aws_account_id = boto3_session.client("sts").get_caller_identity().get("Account")
-    aws_region = boto3_session.region_name
+    click.get_current_context().call_on_close(
+        lambda: get_transfer_metrics().report(metrics_file)
+    )
+
+    boto3_session = get_session(aws_profile)
+    limit_transfers(
+        get_session_client(boto3_session, "s3"), max_bandwidth, max_requests
+    )
+    aws_account_id, aws_region = get_identity(aws_profile)
 
     # Set output path
     # By default add experiment_id to the output path
@@ -1,11 +1,11 @@
 import json
 import re
 
-import boto3
 import click
 from tabulate import tabulate
 
 from ..utils.AuroraClient import AuroraClient
+from ..utils.aws import get_client
 from ..utils.constants import DEFAULT_AWS_PROFILE
 
 SAMPLES = "samples"
@@ -33,7 +33,7 @@ def _get_user_cognito_info(
     env,
     attributes=["name", "email", "custom:agreed_terms", "custom:agreed_emails"],
 ):
-    cognito = boto3.client("cognito-idp")
+    cognito = get_client("cognito-idp")
 
     userpools = cognito.list_user_pools(MaxResults=60)["UserPools"]
 
@@ -1,10 +1,10 @@
 import os
 from pathlib import Path
 
-import boto3
 import click
 
 from ..utils.AuroraClient import AuroraClient
+from ..utils.aws import get_identity, get_session, get_session_client
 from ..utils.constants import (
     CELLSETS_BUCKET,
     DEFAULT_AWS_PROFILE,
@@ -12,6 +12,9 @@ from ..utils.constants import (
     RAW_FILES_BUCKET,
     STAGING,
 )
+from ..utils.throttle import parse_size
+from ..utils.tracing import traced
+from ..utils.transfer import get_transfer_metrics, limit_transfers
 
 SAMPLES = "samples"
 RAW_FILE = "raw_rds"
@@ -32,11 +35,14 @@ file_type_to_name_map = {
 DATA_LOCATION = os.getenv("CELLENICS_DATA_PATH", "./data")
 
 
+@traced("s3")
 def _upload_file(bucket, s3_path, file_path, boto3_session):
-    s3 = boto3_session.resource("s3")
+    s3 = get_session_client(boto3_session, "s3")
 
-    print(f"{file_path}, {bucket}, {s3_path}")
-    s3.meta.client.upload_file(str(file_path), bucket, s3_path)
+    size = os.path.getsize(file_path)
+
+    with get_transfer_metrics().track("upload", bucket, s3_path, size) as callback:
+        s3.upload_file(str(file_path), bucket, s3_path, Callback=callback)
 
 
 def _get_experiment_samples(experiment_id, aurora_client):
@@ -203,8 +209,40 @@ def _upload_cellsets(
     show_default=True,
     help="The name of the profile stored in ~/.aws/credentials to use.",
 )
+@click.option(
+    "--metrics_file",
+    required=False,
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write a JSON summary of the transfers, with throughput per bucket.",
+)
+@click.option(
+    "--max_bandwidth",
+    envvar="CELLENICS_MAX_BANDWIDTH",
+    required=False,
+    default=None,
+    callback=parse_size,
+    help="Limit S3 transfers to this many bytes per second, e.g. 500K or 10M.",
+)
+@click.option(
+    "--max_requests",
+    envvar="CELLENICS_MAX_REQUESTS",
+    required=False,
+    default=None,
+    type=float,
+    help="Limit S3 requests to this many per second.",
+)
 def upload(
-    experiment_id, output_env, input_path, files, all, without_tunnel, aws_profile
+    experiment_id,
+    output_env,
+    input_path,
+    files,
+    all,
+    without_tunnel,
+    aws_profile,
+    metrics_file,
+    max_bandwidth,
+    max_requests,
 ):
     """
     Uploads the files in input_path into the specified experiment_id and environment.\n
@@ -216,8 +254,15 @@ def upload(
     -f samples -f cellsets -o output/folder
     """
 
-    boto3_session = boto3.Session(profile_name=aws_profile)
-    aws_account_id = boto3_session.client("sts").get_caller_identity().get("Account")
+    click.get_current_context().call_on_close(
+        lambda: get_transfer_metrics().report(metrics_file)
+    )
+
+    boto3_session = get_session(aws_profile)
+    limit_transfers(
+        get_session_client(boto3_session, "s3"), max_bandwidth, max_requests
+    )
+    aws_account_id, _ = get_identity(aws_profile)
 
     # Set output path
     # By default add experiment_id to the output path
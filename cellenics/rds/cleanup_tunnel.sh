@@ -1,5 +1,12 @@
-tmp_socket_prefix=/tmp/tmp-tunnel
+#!/bin/bash
+LOCAL_PORT=$1
 
-ssh -O exit -S $tmp_socket_prefix-ssh.sock *
-rm -f $tmp_socket_prefix*
+# Without a port, every open tunnel is closed.
+tmp_socket_prefix=/tmp/tmp-tunnel-${LOCAL_PORT:-*}
+
+for tmp_socket in $tmp_socket_prefix-ssh.sock; do
+	[ -S "$tmp_socket" ] && ssh -O exit -S $tmp_socket *
+done
+
+rm -f $tmp_socket_prefix $tmp_socket_prefix.pub $tmp_socket_prefix-ssh.sock
 echo "Finished cleaning up"
\ No newline at end of file
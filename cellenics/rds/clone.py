@@ -0,0 +1,363 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from subprocess import PIPE, Popen, run
+
+import click
+from inquirer import Confirm, prompt
+from inquirer.themes import GreenPassion
+from tabulate import tabulate
+
+from ..utils.AuroraClient import AuroraClient
+from ..utils.constants import DEFAULT_AWS_PROFILE, DEVELOPMENT, PRODUCTION, STAGING
+from ..utils.tracing import span
+from ..utils.transfer import format_bytes
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _psql(client, sql):
+    result = run(
+        ["psql", "-v", "ON_ERROR_STOP=1", "-c", sql],
+        env={**os.environ, **client.connection_params()},
+        capture_output=True,
+        text=True,
+    )
+
+    if result.returncode != 0:
+        raise Exception(result.stderr.strip())
+
+
+def _stream(source, target, dump_args, restore_args=()):
+    """
+    Pipes `pg_dump` on the source database into `pg_restore` on the target, and
+    returns the number of bytes streamed.
+    """
+    target_params = target.connection_params()
+
+    dump_errors = tempfile.TemporaryFile()
+    restore_errors = tempfile.TemporaryFile()
+
+    with dump_errors, restore_errors:
+        # The archive is read back straight away, so compressing it would only
+        # cost CPU on both ends.
+        dump = Popen(
+            ["pg_dump", "--format=custom", "--compress=0", *dump_args],
+            env={**os.environ, **source.connection_params()},
+            stdout=PIPE,
+            stderr=dump_errors,
+        )
+        restore = Popen(
+            [
+                "pg_restore",
+                "--no-owner",
+                "--no-privileges",
+                f"--dbname={target_params['PGDATABASE']}",
+                *restore_args,
+            ],
+            env={**os.environ, **target_params},
+            stdin=PIPE,
+            stderr=restore_errors,
+        )
+
+        num_bytes = 0
+
+        try:
+            for chunk in iter(lambda: dump.stdout.read(CHUNK_SIZE), b""):
+                restore.stdin.write(chunk)
+                num_bytes += len(chunk)
+
+            restore.stdin.close()
+        except BrokenPipeError:
+            # pg_restore exited early, its error is reported below.
+            dump.kill()
+
+        dump.stdout.close()
+        dump.wait()
+        restore.wait()
+
+        for proc, errors in ((restore, restore_errors), (dump, dump_errors)):
+            if proc.returncode != 0:
+                errors.seek(0)
+                raise Exception(
+                    f"{proc.args[0]} failed:\n{errors.read().decode().strip()}"
+                )
+
+    return num_bytes
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _copy_section(source, target, section, tables, restore_args=()):
+    """
+    Copies the schema objects in `section` for the given tables, or for the
+    whole database if no tables are given.
+    """
+    table_args = [f"--table={table['qualified_name']}" for table in tables]
+
+    with span("rds", "clone", section=section):
+        return _stream(
+            source, target, [f"--section={section}", *table_args], restore_args
+        )
+
+
+def _copy_data(source, target, table=None, exclude_tables=()):
+    """
+    Copies the rows of `table`, or if no table is given, the data not owned by
+    any of `exclude_tables`, like sequence values and large objects.
+    """
+    if table:
+        table_args = [f"--table={table['qualified_name']}"]
+    else:
+        table_args = [f"--exclude-table={t['qualified_name']}" for t in exclude_tables]
+
+    with span("rds", "clone", section="data", table=table and table["name"]):
+        return _stream(source, target, ["--section=data", *table_args])
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--input_env",
+    required=False,
+    default=STAGING,
+    show_default=True,
+    help="Environment of the RDS server to copy from.",
+)
+@click.option(
+    "-s",
+    "--sandbox_id",
+    required=False,
+    default="default",
+    show_default=True,
+    help="Sandbox id to copy from.",
+)
+@click.option(
+    "-o",
+    "--output_env",
+    required=False,
+    default=STAGING,
+    show_default=True,
+    help="Environment of the RDS server to copy to.",
+)
+@click.option(
+    "--output_sandbox_id",
+    required=True,
+    help="Sandbox id to copy to.",
+)
+@click.option(
+    "-t",
+    "--table",
+    "tables",
+    multiple=True,
+    help="Only copy tables matching this pattern, e.g. 'sample*'. Can be repeated.",
+)
+@click.option(
+    "-T",
+    "--exclude_table",
+    "exclude_tables",
+    multiple=True,
+    help="Do not copy tables matching this pattern. Can be repeated.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    required=False,
+    default=4,
+    show_default=True,
+    help="Number of tables to copy at the same time.",
+)
+@click.option(
+    "--clean",
+    is_flag=True,
+    default=False,
+    help="Drop the copied tables in the target database before copying them.",
+)
+@click.option(
+    "-u",
+    "--user",
+    required=False,
+    default="dev_role",
+    show_default=True,
+    help="User to connect as (role is the same as user).",
+)
+@click.option(
+    "-r",
+    "--region",
+    required=False,
+    default="us-east-1",
+    show_default=True,
+    help="Region the RDS servers are in.",
+)
+@click.option(
+    "-p",
+    "--aws_profile",
+    required=False,
+    default=DEFAULT_AWS_PROFILE,
+    show_default=True,
+    help="The name of the profile stored in ~/.aws/credentials to use.",
+)
+def clone(
+    input_env,
+    sandbox_id,
+    output_env,
+    output_sandbox_id,
+    tables,
+    exclude_tables,
+    jobs,
+    clean,
+    user,
+    region,
+    aws_profile,
+):
+    """
+    Copies a database into another environment or sandbox, streaming it from
+    pg_dump into pg_restore without any intermediate files.\n
+    Table definitions are created first, then the tables are filled in parallel,
+    and indexes and constraints are created last.\n
+
+    E.g.:
+    cellenics rds clone -s default --output_sandbox_id my-sandbox --clean
+    """
+
+    if output_env == PRODUCTION:
+        raise click.UsageError("Cloning into production is not supported.")
+
+    # Every development sandbox is the same inframock database.
+    if input_env == output_env == DEVELOPMENT or (input_env, sandbox_id) == (
+        output_env,
+        output_sandbox_id,
+    ):
+        raise click.UsageError("The source and target databases are the same.")
+
+    source = AuroraClient(sandbox_id, user, region, input_env, aws_profile)
+    target = AuroraClient(output_sandbox_id, user, region, output_env, aws_profile)
+
+    with ExitStack() as stack:
+        # Each tunnel listens on its own free port.
+        for client in (source, target):
+            if client.env != DEVELOPMENT:
+                stack.enter_context(client)
+
+        selected_tables = source.list_tables(tables, exclude_tables)
+
+        if not selected_tables:
+            click.echo(click.style("No tables to copy.", fg="yellow"), err=True)
+            return
+
+        questions = [
+            Confirm(
+                "clone",
+                default=False,
+                message=f"Copy {len(selected_tables)} tables from "
+                f"{input_env}-{sandbox_id} into {output_env}-{output_sandbox_id}?"
+                + (" Existing tables will be dropped." if clean else ""),
+            )
+        ]
+        answers = prompt(questions, theme=GreenPassion())
+        if not answers["clone"]:
+            exit(1)
+
+        # With table filters, only those tables and what depends on them are
+        # copied, as pg_dump does with --table.
+        schema_tables = selected_tables if tables or exclude_tables else []
+        restore_args = []
+
+        if clean:
+            # A whole clone recreates every view and constraint that CASCADE
+            # drops. With filters, the objects of tables that are not copied
+            # would be lost, so those drops fail instead.
+            try:
+                _psql(
+                    target,
+                    "DROP TABLE IF EXISTS "
+                    + ", ".join(table["qualified_name"] for table in selected_tables)
+                    + ("" if schema_tables else " CASCADE"),
+                )
+            except Exception as e:
+                raise click.ClickException(
+                    "Could not drop the tables in the target, other objects "
+                    f"depend on them. Copy those tables too, or drop them first.\n{e}"
+                )
+
+            restore_args = ["--clean", "--if-exists"]
+
+        start = time.perf_counter()
+
+        click.echo("Creating tables...")
+        num_bytes, seconds = _timed(
+            _copy_section, source, target, "pre-data", schema_tables, restore_args
+        )
+        steps = [("pre-data", num_bytes, seconds)]
+
+        click.echo(f"Copying {len(selected_tables)} tables with {jobs} jobs...")
+        failed = []
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {}
+
+            for table in selected_tables:
+                future = executor.submit(_timed, _copy_data, source, target, table)
+                futures[future] = table["name"]
+
+            # Sequences not owned by a table and large objects are only copied
+            # along with the whole database.
+            if not schema_tables:
+                future = executor.submit(
+                    _timed, _copy_data, source, target, exclude_tables=selected_tables
+                )
+                futures[future] = "(sequences and large objects)"
+
+            for future in as_completed(futures):
+                name = futures[future]
+
+                try:
+                    num_bytes, seconds = future.result()
+                except Exception as e:
+                    failed.append(name)
+                    click.echo(click.style(f"  {name}: {e}", fg="red"), err=True)
+                    continue
+
+                steps.append((name, num_bytes, seconds))
+                click.echo(f"  {name}: {format_bytes(num_bytes)} in {seconds:.1f}s")
+
+        click.echo("Creating indexes and constraints...")
+        num_bytes, seconds = _timed(
+            _copy_section, source, target, "post-data", schema_tables
+        )
+        steps.append(("post-data", num_bytes, seconds))
+
+    total_seconds = time.perf_counter() - start
+    total_bytes = sum(num_bytes for _, num_bytes, _ in steps)
+
+    click.echo()
+    click.echo(
+        tabulate(
+            [
+                (
+                    name,
+                    format_bytes(num_bytes),
+                    round(seconds, 1),
+                    f"{format_bytes(num_bytes / max(seconds, 1e-9))}/s",
+                )
+                for name, num_bytes, seconds in steps
+            ],
+            headers=["STEP", "SIZE", "SECONDS", "RATE"],
+        )
+    )
+    click.echo(
+        f"\nCopied {format_bytes(total_bytes)} in {total_seconds:.1f}s "
+        f"({format_bytes(total_bytes / max(total_seconds, 1e-9))}/s)"
+    )
+
+    if failed:
+        click.echo(
+            click.style(f"Failed to copy: {', '.join(failed)}", fg="red"), err=True
+        )
+        exit(1)
@@ -0,0 +1,346 @@
+import json
+import os
+import re
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from pathlib import Path
+from subprocess import PIPE, Popen, run
+
+import click
+from tabulate import tabulate
+
+from ..utils.AuroraClient import AuroraClient
+from ..utils.constants import DEFAULT_AWS_PROFILE, DEVELOPMENT, STAGING
+from ..utils.tracing import span
+from ..utils.transfer import format_bytes
+
+MANIFEST_FILE = "manifest.json"
+
+# zstd needs pg_dump 16 or later, a plain level means gzip in every version.
+COMPRESSION_ARGS = {
+    "zstd": lambda level: f"--compress=zstd:{level}",
+    "gzip": lambda level: f"--compress={level}",
+    "none": lambda level: "--compress=0",
+}
+
+# Lines of `pg_restore --list` for table data, e.g.
+# 3456; 0 16390 TABLE DATA public sample postgres
+TABLE_DATA_ENTRY = re.compile(r"^(\d+); \d+ \d+ TABLE DATA (\S+) (\S+) ")
+
+# `pg_dump --verbose` logs when it starts dumping the rows of each table and,
+# with several jobs, when each of them is done, e.g.
+# pg_dump: dumping contents of table "public.sample"
+# pg_dump: finished item 3456 TABLE DATA sample
+DUMPING_TABLE = re.compile(r'dumping contents of table "?(.+?)"?$')
+FINISHED_TABLE = re.compile(r"finished item \d+ TABLE DATA (.+)$")
+
+
+def _dump_sizes(output_path):
+    """
+    Returns the size of the data file of each table in a directory-format dump,
+    keyed by `(schema, name)`.
+    """
+    result = run(
+        ["pg_restore", "--list", str(output_path)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    data_files = {
+        path.name.split(".")[0]: path.stat().st_size
+        for path in output_path.glob("*.dat*")
+    }
+
+    sizes = {}
+    for line in result.stdout.splitlines():
+        match = TABLE_DATA_ENTRY.match(line)
+        if match:
+            dump_id, schema, name = match.groups()
+            sizes[(schema, name)] = data_files.get(dump_id, 0)
+
+    return sizes
+
+
+def _pg_dump(args, env, parallel):
+    """
+    Runs `pg_dump --verbose` and returns its exit code, and how long the rows of
+    each table took to dump keyed by `(schema, name)`. Only warnings and errors
+    of the verbose output are shown.
+    """
+    started = {}
+    seconds = {}
+    current = None
+
+    dump = Popen(["pg_dump", "--verbose", *args], env=env, stderr=PIPE, text=True)
+
+    for line in dump.stderr:
+        now = time.perf_counter()
+        line = line.rstrip()
+
+        # A single job dumps one table after another, and logs nothing while
+        # it does, so a table is done as soon as anything else is logged.
+        if current:
+            seconds[current] = now - started[current]
+            current = None
+
+        dumping = DUMPING_TABLE.search(line)
+        finished = FINISHED_TABLE.search(line)
+
+        if dumping:
+            table = tuple(dumping.group(1).split(".", 1))
+            started[table] = now
+            current = None if parallel else table
+        elif finished:
+            # Items are named after the table alone, so finish the table with
+            # that name that started first.
+            for table in sorted(started, key=started.get):
+                if table[1] == finished.group(1) and table not in seconds:
+                    seconds[table] = now - started[table]
+                    break
+        elif "error" in line.lower() or "warning" in line.lower():
+            click.echo(line, err=True)
+
+    dump.wait()
+
+    if current:
+        seconds[current] = time.perf_counter() - started[current]
+
+    return dump.returncode, seconds
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--input_env",
+    required=False,
+    default=STAGING,
+    show_default=True,
+    help="Input environment of the RDS server.",
+)
+@click.option(
+    "-s",
+    "--sandbox_id",
+    required=False,
+    default="default",
+    show_default=True,
+    help="Default sandbox id.",
+)
+@click.option(
+    "-o",
+    "--output_path",
+    required=False,
+    default=None,
+    help="Folder to write the dump to, must not exist yet. "
+    "Defaults to <input_env>-<sandbox_id>-<timestamp>.",
+)
+@click.option(
+    "-t",
+    "--table",
+    "tables",
+    multiple=True,
+    help="Only dump tables matching this pattern, e.g. 'sample*'. Can be repeated.",
+)
+@click.option(
+    "-T",
+    "--exclude_table",
+    "exclude_tables",
+    multiple=True,
+    help="Do not dump tables matching this pattern. Can be repeated.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    required=False,
+    default=4,
+    show_default=True,
+    help="Number of tables to dump at the same time.",
+)
+@click.option(
+    "-c",
+    "--compression",
+    required=False,
+    default="gzip",
+    show_default=True,
+    type=click.Choice(list(COMPRESSION_ARGS)),
+    help="Compression of the dumped data, zstd requires pg_dump 16 or later.",
+)
+@click.option(
+    "--level",
+    required=False,
+    default=3,
+    show_default=True,
+    help="Compression level.",
+)
+@click.option(
+    "-u",
+    "--user",
+    required=False,
+    default="dev_role",
+    show_default=True,
+    help="User to connect as (role is the same as user).",
+)
+@click.option(
+    "-r",
+    "--region",
+    required=False,
+    default="us-east-1",
+    show_default=True,
+    help="Region the RDS server is in.",
+)
+@click.option(
+    "-p",
+    "--aws_profile",
+    required=False,
+    default=DEFAULT_AWS_PROFILE,
+    show_default=True,
+    help="The name of the profile stored in ~/.aws/credentials to use.",
+)
+def dump(
+    input_env,
+    sandbox_id,
+    output_path,
+    tables,
+    exclude_tables,
+    jobs,
+    compression,
+    level,
+    user,
+    region,
+    aws_profile,
+):
+    """
+    Dumps a database into a compressed folder, dumping several tables at the
+    same time. A manifest.json file with the size, row count and dump time of
+    every table is written next to the data.\n
+    The dump can be restored with `pg_restore -j <jobs> -d <database> <folder>`.
+
+    E.g.:
+    cellenics rds dump -i staging -s default -T 'plot*' -c zstd
+    """
+
+    started_at = datetime.now(timezone.utc)
+
+    if output_path is None:
+        output_path = f"{input_env}-{sandbox_id}-{started_at.strftime('%Y%m%d-%H%M%S')}"
+
+    output_path = Path(output_path)
+
+    if output_path.exists():
+        raise click.UsageError(f"{output_path} already exists.")
+
+    client = AuroraClient(sandbox_id, user, region, input_env, aws_profile)
+
+    with ExitStack() as stack:
+        if input_env != DEVELOPMENT:
+            stack.enter_context(client)
+
+        start = time.perf_counter()
+        selected_tables = client.list_tables(tables, exclude_tables)
+        list_seconds = time.perf_counter() - start
+
+        if not selected_tables:
+            click.echo(click.style("No tables to dump.", fg="yellow"), err=True)
+            return
+
+        click.echo(f"Counting the rows of {len(selected_tables)} tables...")
+
+        start = time.perf_counter()
+        row_counts = client.count_rows(selected_tables)
+        count_seconds = time.perf_counter() - start
+
+        # pg_dump matches patterns against the table name or `schema.table`,
+        # as list_tables does.
+        table_args = [f"--table={pattern}" for pattern in tables] + [
+            f"--exclude-table={pattern}" for pattern in exclude_tables
+        ]
+
+        click.echo(
+            f"Dumping {len(selected_tables)} tables to {output_path} "
+            f"with {jobs} jobs..."
+        )
+
+        start = time.perf_counter()
+
+        with span("rds", "dump", jobs=jobs, compression=compression):
+            returncode, table_seconds = _pg_dump(
+                [
+                    "--format=directory",
+                    f"--jobs={jobs}",
+                    COMPRESSION_ARGS[compression](level),
+                    f"--file={output_path}",
+                    *table_args,
+                ],
+                {**os.environ, **client.connection_params()},
+                parallel=jobs > 1,
+            )
+
+        dump_seconds = time.perf_counter() - start
+
+    if returncode != 0:
+        raise Exception(f"pg_dump failed with exit code {returncode}")
+
+    dump_sizes = _dump_sizes(output_path)
+
+    manifest_tables = []
+    for table in selected_tables:
+        key = (table["schema"], table["name"])
+        seconds = table_seconds.get(key)
+
+        manifest_tables.append(
+            {
+                "schema": table["schema"],
+                "name": table["name"],
+                "rows": row_counts.get(key),
+                "estimated_rows": table["estimated_rows"],
+                "database_bytes": table["bytes"],
+                "dump_bytes": dump_sizes.get(key),
+                "dump_seconds": None if seconds is None else round(seconds, 3),
+            }
+        )
+
+    manifest = {
+        "environment": input_env,
+        "sandbox_id": sandbox_id,
+        "created_at": started_at.isoformat(),
+        "format": "directory",
+        "compression": compression,
+        "level": level,
+        "jobs": jobs,
+        "seconds": {
+            "list_tables": round(list_seconds, 3),
+            "count_rows": round(count_seconds, 3),
+            "dump": round(dump_seconds, 3),
+        },
+        "bytes": sum(path.stat().st_size for path in output_path.iterdir()),
+        "tables": manifest_tables,
+    }
+
+    with open(output_path / MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    click.echo()
+    click.echo(
+        tabulate(
+            [
+                (
+                    f"{table['schema']}.{table['name']}",
+                    table["rows"],
+                    format_bytes(table["database_bytes"]),
+                    format_bytes(table["dump_bytes"] or 0),
+                    table["dump_seconds"],
+                )
+                for table in manifest["tables"]
+            ],
+            headers=["TABLE", "ROWS", "DATABASE SIZE", "DUMP SIZE", "SECONDS"],
+        )
+    )
+
+    total_bytes = sum(table["bytes"] for table in selected_tables)
+    click.echo(
+        f"\nDumped {format_bytes(total_bytes)} into {format_bytes(manifest['bytes'])} "
+        f"in {dump_seconds:.1f}s "
+        f"({format_bytes(total_bytes / max(dump_seconds, 1e-9))}/s)"
+    )
+    click.echo(f"Manifest written to {output_path / MANIFEST_FILE}")
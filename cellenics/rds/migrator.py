@@ -1,7 +1,14 @@
+import json
 import os
+import re
+import socket
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, closing
 
 import click
+from tabulate import tabulate
 
 from ..utils.AuroraClient import AuroraClient
 from ..utils.constants import DEFAULT_AWS_ACCOUNT_ID, DEVELOPMENT, STAGING
@@ -11,16 +18,109 @@ MODULE_PATH = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_IAC_PATH = os.path.join(MODULE_PATH, "../../../iac")
 IAC_PATH = os.getenv("CELLENICS_IAC_PATH", DEFAULT_IAC_PATH)
 
+DEFAULT_COMMAND = ("migrate:latest",)
 
-def _migrate(command, iac_path, migration_env):
+# `knex migrate:list` prints a "Found N Pending Migration file/files." line
+# followed by the name of each pending migration.
+PENDING_HEADER = re.compile(r"Found \d+ Pending Migration")
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def _run_knex(command, iac_path, migration_env):
+    """
+    Runs a knex command with its output captured, and returns how long it took,
+    its exit code and its output.
+    """
     knex_command = ["node_modules/.bin/knex", "--cwd", iac_path] + list(command)
 
-    proc = subprocess.Popen(
+    start = time.perf_counter()
+    result = subprocess.run(
         knex_command,
         cwd=iac_path,
         env=migration_env,
+        capture_output=True,
+        text=True,
     )
-    proc.wait()
+
+    return {
+        "command": " ".join(command),
+        "seconds": round(time.perf_counter() - start, 3),
+        "returncode": result.returncode,
+        "output": ANSI_ESCAPE.sub("", result.stdout + result.stderr).strip(),
+    }
+
+
+def _pending_migrations(output):
+    pending = []
+    in_pending = False
+
+    for line in output.splitlines():
+        line = line.strip()
+
+        if line.startswith("Found"):
+            in_pending = bool(PENDING_HEADER.match(line))
+        elif in_pending and line:
+            pending.append(line)
+
+    return pending
+
+
+def _migrate(command, iac_path, migration_env, plan=False):
+    """
+    Lists the pending migrations and, unless only planning, runs `command`.
+    Returns a report of every step.
+    """
+    steps = [_run_knex(("migrate:list",), iac_path, migration_env)]
+    report = {"pending": _pending_migrations(steps[0]["output"]), "steps": steps}
+
+    if steps[0]["returncode"] != 0:
+        report["status"] = "failed"
+    elif plan:
+        report["status"] = "planned"
+    elif command == DEFAULT_COMMAND and not report["pending"]:
+        report["status"] = "up to date"
+    else:
+        steps.append(_run_knex(command, iac_path, migration_env))
+        report["status"] = "migrated" if steps[-1]["returncode"] == 0 else "failed"
+
+    return report
+
+
+def _hold_port(port):
+    """
+    Binds `port` without listening on it, so connections to it are refused and
+    no tunnel can be opened on it until the returned socket is closed.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    try:
+        sock.bind(("localhost", port))
+    except OSError:
+        sock.close()
+        raise click.UsageError(
+            f"Port {port} is in use. Close the tunnel listening on it before "
+            "migrating several sandboxes at the same time."
+        )
+
+    return sock
+
+
+def _print_report(name, report):
+    color = "red" if report["status"] == "failed" else "green"
+    click.echo(click.style(f"\n== {name}: {report['status']}", fg=color))
+
+    if report.get("error"):
+        click.echo(click.style(report["error"], fg="red"))
+
+    for migration in report["pending"]:
+        click.echo(f"  pending: {migration}")
+
+    # The migration list is already summarized above, unless it failed.
+    for step in report["steps"]:
+        if "output" in step and (
+            step["returncode"] != 0 or step["command"] != "migrate:list"
+        ):
+            click.echo(step["output"])
 
 
 @click.command()
@@ -35,10 +135,11 @@ def _migrate(command, iac_path, migration_env):
 @click.option(
     "-s",
     "--sandbox_id",
+    "sandbox_ids",
     required=False,
-    default=None,
-    show_default=True,
-    help="Sandbox id to migrate to. Required if migrating to staging",
+    multiple=True,
+    help="Sandbox id to migrate to. Required if migrating to staging. "
+    "Can be repeated to migrate several sandboxes at the same time.",
 )
 @click.option(
     "--iac_path",
@@ -47,8 +148,28 @@ def _migrate(command, iac_path, migration_env):
     show_default=True,
     help="Path to the IAC folder",
 )
+@click.option(
+    "-j",
+    "--jobs",
+    required=False,
+    default=4,
+    show_default=True,
+    help="Number of sandboxes to migrate at the same time.",
+)
+@click.option(
+    "--plan",
+    is_flag=True,
+    default=False,
+    help="Only list the pending migrations, without running the command.",
+)
+@click.option(
+    "--report_file",
+    required=False,
+    default=None,
+    help="Write the pending migrations and the time of every step to this JSON file.",
+)
 @click.argument("command", required=False, nargs=-1)
-def migrator(iac_path, sandbox_id, input_env, command):
+def migrator(iac_path, sandbox_ids, input_env, jobs, plan, report_file, command):
     """
     Runs knex migration command (default to migrate:latest) in local or staged env.
 
@@ -56,7 +177,8 @@ def migrator(iac_path, sandbox_id, input_env, command):
         cellenics rds migrator\n
         cellenics rds migrator -- migrate:down\n
         cellenics rds migrator -i staging -s <sandbox_id>\n
-        cellenics rds migrator -i staging -s <sandbox_id> -- migrate:rollback --all
+        cellenics rds migrator -i staging -s <sandbox_id> -- migrate:rollback --all\n
+        cellenics rds migrator -i staging -s <sandbox_id> -s <sandbox_id> --plan
     """
 
     REGION = "us-east-1"
@@ -71,23 +193,118 @@ def migrator(iac_path, sandbox_id, input_env, command):
 
     # Empty command evaluates to empty tuple
     if not command:
-        command = ("migrate:latest",)
+        command = DEFAULT_COMMAND
 
     iac_path = os.path.join(iac_path, "migrations/sql-migrations/")
 
-    migration_env = {
-        **os.environ,
-        "NODE_ENV": input_env,
-        "SANDBOX_ID": str(sandbox_id),
-        "AWS_ACCOUNT_ID": AWS_ACCOUNT_ID,
-        "AWS_REGION": REGION,
-    }
+    if input_env != DEVELOPMENT and not sandbox_ids:
+        raise Exception("""Migrating to staged env without sandbox id.""")
 
-    if input_env == DEVELOPMENT:
-        _migrate(command, iac_path, migration_env)
-    else:
-        if not sandbox_id:
-            raise Exception("""Migrating to staged env without sandbox id.""")
+    def migration_env(sandbox_id, local_port):
+        # The knexfile leaves the port to node-postgres, which reads it from
+        # PGPORT, so each sandbox goes through its own tunnel.
+        return {
+            **os.environ,
+            "NODE_ENV": input_env,
+            "SANDBOX_ID": str(sandbox_id),
+            "AWS_ACCOUNT_ID": AWS_ACCOUNT_ID,
+            "AWS_REGION": REGION,
+            "PGPORT": str(local_port),
+        }
+
+    def failed(error):
+        return {"pending": [], "steps": [], "status": "failed", "error": error}
+
+    reports = {}
+    envs = {}
+
+    with ExitStack() as stack:
+        if input_env == DEVELOPMENT:
+            reports[DEVELOPMENT] = {"steps": []}
+            envs[DEVELOPMENT] = migration_env(
+                sandbox_ids[0] if sandbox_ids else None, LOCAL_PORT
+            )
+        else:
+            # A single sandbox keeps the usual port. With several, each tunnel
+            # finds a free port of its own, and the usual port is held closed
+            # so a knexfile that ignores PGPORT fails to connect instead of
+            # migrating whatever database is behind that port.
+            local_port = LOCAL_PORT
+
+            if len(sandbox_ids) > 1:
+                stack.enter_context(closing(_hold_port(LOCAL_PORT)))
+                local_port = None
+
+            # Tunnels are opened one at a time, so each finds its own free port.
+            for sandbox_id in sandbox_ids:
+                client = AuroraClient(
+                    sandbox_id, USER, REGION, input_env, AWS_PROFILE, local_port
+                )
+
+                start = time.perf_counter()
+
+                try:
+                    stack.enter_context(client)
+                except Exception as e:
+                    reports[sandbox_id] = failed(f"Could not open tunnel: {e}")
+                    _print_report(sandbox_id, reports[sandbox_id])
+                    continue
+
+                reports[sandbox_id] = {
+                    "steps": [
+                        {
+                            "command": "open tunnel",
+                            "seconds": round(time.perf_counter() - start, 3),
+                            "returncode": 0,
+                        }
+                    ]
+                }
+                envs[sandbox_id] = migration_env(sandbox_id, client.local_port)
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(_migrate, command, iac_path, env, plan): name
+                for name, env in envs.items()
+            }
+
+            for future in as_completed(futures):
+                name = futures[future]
+
+                try:
+                    report = future.result()
+                except Exception as e:
+                    report = failed(str(e))
+
+                report["steps"] = reports[name]["steps"] + report["steps"]
+                reports[name] = report
+
+                _print_report(name, report)
+
+    click.echo()
+    click.echo(
+        tabulate(
+            [
+                (
+                    name,
+                    len(report["pending"]),
+                    report["status"],
+                    round(sum(step["seconds"] for step in report["steps"]), 1),
+                )
+                for name, report in reports.items()
+            ],
+            headers=["SANDBOX", "PENDING", "STATUS", "SECONDS"],
+        )
+    )
+
+    if report_file:
+        with open(report_file, "w") as f:
+            json.dump(
+                [{"sandbox_id": name, **report} for name, report in reports.items()],
+                f,
+                indent=2,
+            )
+
+        click.echo(f"Migration report written to {report_file}")
 
-        with AuroraClient(sandbox_id, USER, REGION, input_env, AWS_PROFILE, LOCAL_PORT):
-            _migrate(command, iac_path, migration_env)
+    if any(report["status"] == "failed" for report in reports.values()):
+        exit(1)
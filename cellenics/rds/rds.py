@@ -1,5 +1,7 @@
 import click
 
+from .clone import clone
+from .dump import dump
 from .migrator import migrator
 from .run import run
 from .token import token
@@ -18,3 +20,5 @@ rds.add_command(tunnel)
 rds.add_command(run)
 rds.add_command(token)
 rds.add_command(migrator)
+rds.add_command(clone)
+rds.add_command(dump)
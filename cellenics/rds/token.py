@@ -1,8 +1,8 @@
 import sys
 
-import boto3
 import click
 
+from ..utils.aws import get_client
 from ..utils.constants import DEFAULT_AWS_PROFILE, STAGING
 
 # we use writer because reader might also point to writer making it not safe
@@ -63,8 +63,7 @@ def token(input_env, user, region, sandbox_id, aws_profile):
 
     db_port = 5432
 
-    session = boto3.Session(profile_name=aws_profile)
-    rds_client = session.client("rds")
+    rds_client = get_client("rds", aws_profile)
 
     remote_endpoint = get_rds_endpoint(input_env, sandbox_id, rds_client, ENDPOINT_TYPE)
 
@@ -5,11 +5,17 @@ from subprocess import DEVNULL, run
 import click
 
 from ..utils.constants import DEFAULT_AWS_PROFILE, STAGING
+from ..utils.tracing import traced
+
+# Ports of the tunnels opened by this process, so interrupting it leaves the
+# tunnels of other sessions alone.
+_open_ports = set()
 
 
 def force_exit_handler(signum, frame):
-    file_dir = pathlib.Path(__file__).parent.resolve()
-    run(f"{file_dir}/cleanup_tunnel.sh", shell=True)
+    for local_port in list(_open_ports):
+        close_tunnel(local_port)
+
     exit()
 
 
@@ -84,9 +90,10 @@ Press enter to close session.
 """
     )
 
-    close_tunnel()
+    close_tunnel(local_port)
 
 
+@traced("rds")
 def open_tunnel(input_env, region, sandbox_id, local_port, aws_profile, verbose=False):
     signal.signal(signal.SIGINT, force_exit_handler)
 
@@ -96,6 +103,8 @@ def open_tunnel(input_env, region, sandbox_id, local_port, aws_profile, verbose=
     endpoint_type = "writer"
     file_dir = pathlib.Path(__file__).parent.resolve()
 
+    _open_ports.add(local_port)
+
     run(
         [
             f"{file_dir}/tunnel.sh",
@@ -110,6 +119,10 @@ def open_tunnel(input_env, region, sandbox_id, local_port, aws_profile, verbose=
     )
 
 
-def close_tunnel():
+def close_tunnel(local_port):
+    """
+    Closes the tunnel listening on `local_port`.
+    """
     file_dir = pathlib.Path(__file__).parent.resolve()
-    run(f"{file_dir}/cleanup_tunnel.sh", shell=True)
+    run([f"{file_dir}/cleanup_tunnel.sh", str(local_port)])
+    _open_ports.discard(local_port)
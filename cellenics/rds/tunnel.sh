@@ -62,7 +62,9 @@ then
 	exit 1
 fi
 
-tmp_socket_prefix=/tmp/tmp-tunnel
+# Each local port gets its own key and control socket, so tunnels to
+# different databases can be open at the same time.
+tmp_socket_prefix=/tmp/tmp-tunnel-$LOCAL_PORT
 
 rm -f "${tmp_socket_prefix}"
 
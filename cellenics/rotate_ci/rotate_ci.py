@@ -1,50 +1,200 @@
 import json
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 
-import boto3
 import cfn_flip
 import click
 import requests
-from botocore.config import Config
-from github import Github
 from inquirer import Confirm, prompt
 from inquirer.themes import GreenPassion
+from tabulate import tabulate
+
+from ..utils.aws import get_client
+from ..utils.cache import read_cache, write_cache
+from ..utils.encrypt import encrypt_all
+from ..utils.github_api import (
+    GITHUB_API_URL,
+    get_github,
+    github_request,
+    graphql_with_errors,
+)
+
+# The CI users stack is deployed in us-east-1, where IAM is also managed from.
+AWS_REGION = "us-east-1"
+
+CI_FILES = (".ci.yml", ".ci.yaml")
+
+# GitHub limits how many nodes a single GraphQL query may resolve, so repository
+# lookups are split in batches, a few of them in flight at the same time.
+REPOS_PER_QUERY = 50
+MAX_WORKERS = 4
+
+IAM_MAX_WORKERS = 8
 
-from ..utils.encrypt import encrypt
+CI_POLICIES_CACHE = "ci-policies"
 
-config = Config(
-    region_name="us-east-1",
+# The stack has reached a final state, or is bound to fail anyway.
+STACK_COMPLETE_STATUSES = (
+    "CREATE_COMPLETE",
+    "UPDATE_COMPLETE",
+    "UPDATE_COMPLETE_CLEANUP_IN_PROGRESS",
 )
+STACK_FAILED_STATUSES = (
+    "CREATE_FAILED",
+    "ROLLBACK_IN_PROGRESS",
+    "ROLLBACK_FAILED",
+    "ROLLBACK_COMPLETE",
+    "DELETE_IN_PROGRESS",
+    "DELETE_FAILED",
+    "DELETE_COMPLETE",
+    "UPDATE_FAILED",
+    "UPDATE_ROLLBACK_IN_PROGRESS",
+    "UPDATE_ROLLBACK_FAILED",
+    "UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS",
+    "UPDATE_ROLLBACK_COMPLETE",
+)
+
+MIN_POLL_DELAY = 1
+MAX_POLL_DELAY = 15
+DEFAULT_STACK_TIMEOUT = 1800
 
 
 def recursive_get(d, *keys):
     return reduce(lambda c, k: c.get(k, {}), keys, d)
 
 
-def filter_iam_repos(repo):
-    if repo.archived:
-        return False
+def _get_ci_files(token, org, repo_names, with_text=False):
+    """
+    Looks up the `.ci.yml` (or `.ci.yaml`) file at HEAD of each of `repo_names`
+    in a single GraphQL query.
+
+    Returns a dictionary mapping each repository name to the blob of its CI
+    file, or None if it has none. Blobs always include their SHA (`oid`), and
+    their contents (`text`) only if `with_text` is set.
+
+    Repositories that could not be looked up, for example because the token
+    cannot see them, are reported and treated as having no CI file.
+    """
+
+    blob_fields = "oid text" if with_text else "oid"
+
+    # The same lookups are made in every repository, so they are only built once.
+    ci_file_fields = " ".join(
+        f'f{j}: object(expression: "HEAD:{ci_file}") '
+        f"{{ ... on Blob {{ {blob_fields} }} }}"
+        for j, ci_file in enumerate(CI_FILES)
+    )
+
+    params = ["$org: String!"]
+    fields = []
+    variables = {"org": org}
+
+    for i, name in enumerate(repo_names):
+        params.append(f"$n{i}: String!")
+        fields.append(
+            f"r{i}: repository(owner: $org, name: $n{i}) {{ {ci_file_fields} }}"
+        )
+        variables[f"n{i}"] = name
+
+    query = f"query({', '.join(params)}) {{ {' '.join(fields)} }}"
+    data, errors = graphql_with_errors(token, query, variables)
+
+    # Errors point at the field they come from, e.g. ["r3"] for the fourth
+    # repository of the batch.
+    aliases = {f"r{i}": name for i, name in enumerate(repo_names)}
+
+    for error in errors:
+        path = error.get("path") or []
+        name = aliases.get(path[0]) if path else None
+
+        click.echo(
+            click.style(
+                f"Could not look up the CI file of {name or org}: {error['message']}",
+                fg="yellow",
+            ),
+            err=True,
+        )
+
+    ci_files = {}
+    for i, name in enumerate(repo_names):
+        repo = data.get(f"r{i}") or {}
+        blobs = [repo.get(f"f{j}") for j in range(len(CI_FILES))]
+
+        ci_files[name] = next((blob for blob in blobs if blob), None)
+
+    return ci_files
+
+
+def _get_ci_files_in_batches(token, org, repo_names, with_text=False):
+    batches = [
+        repo_names[i : i + REPOS_PER_QUERY]
+        for i in range(0, len(repo_names), REPOS_PER_QUERY)
+    ]
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(
+            lambda batch: _get_ci_files(token, org, batch, with_text=with_text),
+            batches,
+        )
+
+    return {name: blob for ci_files in results for name, blob in ci_files.items()}
+
+
+def filter_iam_repos(repos, token, org):
+    """
+    Returns a dictionary mapping the name of each repository marked as requiring
+    CI IAM policies to its policies.
+
+    Archived repositories are skipped without making any request. The others are
+    looked up in batches, which are sent concurrently.
+
+    Parsed policies are cached on disk by the SHA of the CI file they come from,
+    so only CI files that changed since the last run are downloaded and parsed.
+    """
+
+    repo_names = [repo.name for repo in repos if not repo.archived]
+    ci_files = _get_ci_files_in_batches(token, org, repo_names)
+
+    policies = {}
+    changed = []
+
+    for repo_name, blob in ci_files.items():
+        if not blob:
+            continue
+
+        cached = read_cache(CI_POLICIES_CACHE, f"{org}/{repo_name}")
 
-    # get files in root
-    contents = repo.get_contents("")
+        if cached and cached["oid"] == blob["oid"]:
+            if cached["policies"]:
+                policies[repo_name] = cached["policies"]
+        else:
+            changed.append(repo_name)
 
-    for content in contents:
-        # search for tags.y(a)ml file
-        if content.path != ".ci.yml" and content.path != ".ci.yaml":
+    ci_files = _get_ci_files_in_batches(token, org, changed, with_text=True)
+
+    for repo_name, blob in ci_files.items():
+        if not blob:
             continue
 
         # open contents
-        tags = cfn_flip.to_json(content.decoded_content)
+        tags = cfn_flip.to_json(blob["text"])
 
         tags = json.loads(tags)
 
-        if recursive_get(tags, "ci-policies"):
-            return repo.name, recursive_get(tags, "ci-policies")
+        repo_policies = recursive_get(tags, "ci-policies")
 
-        return False
+        write_cache(
+            CI_POLICIES_CACHE,
+            f"{org}/{repo_name}",
+            {"oid": blob["oid"], "policies": repo_policies},
+        )
 
-    return False
+        if repo_policies:
+            policies[repo_name] = repo_policies
+
+    return policies
 
 
 # CF template names can't contain underscores or dashes, remove them and capitalize
@@ -53,7 +203,70 @@ def format_name_for_cf(repo_name):
     return repo_name.replace("_", " ").replace("-", " ").title().replace(" ", "")
 
 
-def create_new_iam_users(policies):
+def _get_new_stack_events(cf, stack_id, request_token, seen):
+    """
+    Returns the events of the stack operation identified by `request_token` that
+    are not in `seen`, oldest first.
+    """
+    events = []
+
+    # Events are listed newest first, so we can stop paging as soon as we reach
+    # an event we have already seen or one from a previous operation.
+    paginator = cf.get_paginator("describe_stack_events")
+    for page in paginator.paginate(StackName=stack_id):
+        for event in page["StackEvents"]:
+            if (
+                event["EventId"] in seen
+                or event.get("ClientRequestToken") != request_token
+            ):
+                return events[::-1]
+
+            events.append(event)
+
+    return events[::-1]
+
+
+def wait_for_stack(cf, stack_id, request_token, timeout):
+    """
+    Waits for the stack operation identified by `request_token` to finish,
+    printing the progress of each resource as it is reported.
+
+    Polls often while resources are changing and backs off when nothing
+    happens. Returns the terminal status of the stack as soon as it is reached,
+    or None if `timeout` seconds pass first.
+    """
+    seen = set()
+    delay = MIN_POLL_DELAY
+    deadline = time.monotonic() + timeout
+
+    while True:
+        events = _get_new_stack_events(cf, stack_id, request_token, seen)
+
+        for event in events:
+            seen.add(event["EventId"])
+
+            reason = event.get("ResourceStatusReason")
+            click.echo(
+                f"  {event['LogicalResourceId']:<35}{event['ResourceStatus']}"
+                + (f" ({reason})" if reason else "")
+            )
+
+            if event["PhysicalResourceId"] != stack_id:
+                continue
+
+            status = event["ResourceStatus"]
+            if status in STACK_COMPLETE_STATUSES or status in STACK_FAILED_STATUSES:
+                return status
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+
+        delay = MIN_POLL_DELAY if events else min(delay * 2, MAX_POLL_DELAY)
+        time.sleep(min(delay, remaining))
+
+
+def create_new_iam_users(policies, timeout=DEFAULT_STACK_TIMEOUT):
     users = {}
 
     for repo, policies in policies.items():
@@ -74,12 +287,14 @@ def create_new_iam_users(policies):
     }
 
     stack_cfg = cfn_flip.to_yaml(json.dumps(stack_cfg))
-    cf = boto3.client("cloudformation", config=config)
+    cf = get_client("cloudformation", region=AWS_REGION)
 
     kwargs = {
         "StackName": "biomage-ci-users",
         "TemplateBody": stack_cfg,
         "Capabilities": ["CAPABILITY_IAM", "CAPABILITY_NAMED_IAM"],
+        # Tags the events caused by this operation, so we can follow them.
+        "ClientRequestToken": str(uuid.uuid4()),
     }
 
     try:
@@ -87,6 +302,7 @@ def create_new_iam_users(policies):
     except Exception as e:
         if "AlreadyExistsException" in str(e):
             try:
+                kwargs["ClientRequestToken"] = str(uuid.uuid4())
                 stack = cf.update_stack(**kwargs)
             except Exception as e:
                 if "No updates are to be performed" in str(e):
@@ -97,134 +313,224 @@ def create_new_iam_users(policies):
         else:
             raise e
 
-    click.echo(
-        "Now creating CloudFormation stack. Waiting for completion...",
-        nl=False,
-    )
-
-    while True:
-        time.sleep(10)
-        response = cf.describe_stacks(StackName=stack["StackId"])
+    click.echo("Now creating CloudFormation stack. Waiting for completion...")
 
-        status = response["Stacks"][0]["StackStatus"]
+    status = wait_for_stack(cf, stack["StackId"], kwargs["ClientRequestToken"], timeout)
 
-        if "FAILED" in status or "ROLLBACK" in status or "DELETE" in status:
-            click.echo()
-            click.echo(
-                click.style(
-                    f"✖️ Stack creation failed with error {status}. "
-                    "Check the AWS Console for more details.",
-                    fg="red",
-                    bold=True,
-                )
+    if status is None:
+        click.echo(
+            click.style(
+                f"✖️ Stack was not ready after {timeout} seconds. "
+                "Check the AWS Console for more details.",
+                fg="red",
+                bold=True,
             )
-            exit(1)
-        elif "COMPLETE" in status:
-            click.echo()
-            click.echo(f"Stack successfully created with status {status}.")
-            break
-        else:
-            click.echo(".", nl=False)
+        )
+        exit(1)
+    elif status in STACK_FAILED_STATUSES:
+        click.echo(
+            click.style(
+                f"✖️ Stack creation failed with error {status}. "
+                "Check the AWS Console for more details.",
+                fg="red",
+                bold=True,
+            )
+        )
+        exit(1)
 
+    click.echo(f"Stack successfully created with status {status}.")
     click.echo("Created new users.")
 
 
+def _create_access_key(iam, repo):
+    key = iam.create_access_key(UserName=f"ci-user-{repo}")
+
+    return key["AccessKey"]["AccessKeyId"], key["AccessKey"]["SecretAccessKey"]
+
+
 def create_new_access_keys(iam, roles):
     click.echo("Now creating new access keys for users...")
+
+    with ThreadPoolExecutor(max_workers=IAM_MAX_WORKERS) as executor:
+        futures = {
+            repo: executor.submit(_create_access_key, iam, repo) for repo in roles
+        }
+
     keys = {}
+    errors = {}
+
+    for repo, future in futures.items():
+        try:
+            keys[repo] = future.result()
+        except Exception as e:
+            errors[repo] = e
+
+    # Don't leave any of the new keys behind if we can't rotate all of them.
+    if errors:
+        with ThreadPoolExecutor(max_workers=IAM_MAX_WORKERS) as executor:
+            deletes = {
+                repo: executor.submit(
+                    iam.delete_access_key,
+                    UserName=f"ci-user-{repo}",
+                    AccessKeyId=key_id,
+                )
+                for repo, (key_id, _) in keys.items()
+            }
+
+        orphaned = []
 
-    for repo in roles:
-        key = iam.create_access_key(UserName=f"ci-user-{repo}")
-        keys[repo] = (
-            key["AccessKey"]["AccessKeyId"],
-            key["AccessKey"]["SecretAccessKey"],
+        for repo, future in deletes.items():
+            try:
+                future.result()
+            except Exception as e:
+                orphaned.append(f"ci-user-{repo} ({keys[repo][0]}): {e}")
+
+        message = "Could not create new access keys for:\n" + "\n".join(
+            f"  - ci-user-{repo}: {e}" for repo, e in errors.items()
         )
 
+        if orphaned:
+            message += (
+                "\nThe following new keys could not be removed and must be "
+                "deleted manually:\n" + "\n".join(f"  - {key}" for key in orphaned)
+            )
+
+        raise Exception(message) from next(iter(errors.values()))
+
     return keys
 
 
+def _update_repo_secrets(token, repo_url, secrets):
+    # The public key is served from the HTTP cache unless GitHub rotated it.
+    ci_keys = github_request("GET", f"{repo_url}/actions/secrets/public-key", token)
+
+    if ci_keys.status_code != requests.codes.ok:
+        return {name: ci_keys.status_code for name in secrets}
+
+    ci_keys = ci_keys.json()
+
+    encrypted_secrets = encrypt_all(ci_keys["key"], secrets)
+
+    results = {}
+
+    for name, encrypted_value in encrypted_secrets.items():
+        r = github_request(
+            "PUT",
+            f"{repo_url}/actions/secrets/{name}",
+            token,
+            json={"encrypted_value": encrypted_value, "key_id": ci_keys["key_id"]},
+        )
+
+        results[name] = r.status_code
+
+    return results
+
+
 def update_github_secrets(keys, token, org):
+    """
+    Publishes the new access keys (and the GitHub token) as secrets of each
+    repository, updating several repositories concurrently.
+
+    Returns a dictionary mapping each repository name to the HTTP status code
+    of the update of each of its secrets. If a repository could not be updated
+    at all, each of its secrets maps to the name of the error instead.
+    """
     click.echo("Now updating all repositories with new keys...")
 
-    s = requests.Session()
-    s.headers = {"Authorization": f"token {token}", "User-Agent": "Requests"}
-    url_base = f"https://api.github.com/repos/{org.login}"
+    url_base = f"{GITHUB_API_URL}/repos/{org.login}"
 
-    results = {}
+    secrets = {
+        repo_name: {
+            "AWS_ACCESS_KEY_ID": access_key_id,
+            "AWS_SECRET_ACCESS_KEY": secret_access_key,
+            "API_TOKEN_GITHUB": token,
+        }
+        for repo_name, (access_key_id, secret_access_key) in keys.items()
+    }
 
-    for repo_name, (access_key_id, secret_access_key) in keys.items():
-        ci_keys = s.get(f"{url_base}/{repo_name}/actions/secrets/public-key")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            repo_name: executor.submit(
+                _update_repo_secrets, token, f"{url_base}/{repo_name}", repo_secrets
+            )
+            for repo_name, repo_secrets in secrets.items()
+        }
 
-        if ci_keys.status_code != requests.codes.ok:
-            results[repo_name] = ci_keys.status_code
-            continue
+    result_codes = {}
 
-        ci_keys = ci_keys.json()
+    for repo_name, future in futures.items():
+        try:
+            result_codes[repo_name] = future.result()
+        except Exception as e:
+            # Keep going, so the keys of this repository are rolled back with
+            # the rest instead of being left behind.
+            click.echo(
+                click.style(f"Could not update {repo_name}: {e}", fg="red"), err=True
+            )
+            result_codes[repo_name] = {
+                name: type(e).__name__ for name in secrets[repo_name]
+            }
 
-        access_key_id = encrypt(ci_keys["key"], access_key_id)
-        secret_access_key = encrypt(ci_keys["key"], secret_access_key)
-        encrypted_token = encrypt(ci_keys["key"], token)
+    return result_codes
 
-        r = s.put(
-            f"{url_base}/{repo_name}/actions/secrets/AWS_ACCESS_KEY_ID",
-            json={"encrypted_value": access_key_id, "key_id": ci_keys["key_id"]},
-        )
 
-        r = s.put(
-            f"{url_base}/{repo_name}/actions/secrets/AWS_SECRET_ACCESS_KEY",
-            json={"encrypted_value": secret_access_key, "key_id": ci_keys["key_id"]},
-        )
+def _finalize_access_keys(iam, repo, generated_key_id, codes):
+    username = f"ci-user-{repo}"
 
-        r = s.put(
-            f"{url_base}/{repo_name}/actions/secrets/API_TOKEN_GITHUB",
-            json={"encrypted_value": encrypted_token, "key_id": ci_keys["key_id"]},
-        )
+    # Only keep the new key if every secret was updated with it.
+    if not all(isinstance(code, int) and 200 <= code <= 299 for code in codes.values()):
+        iam.delete_access_key(UserName=username, AccessKeyId=generated_key_id)
+        return False, "Key rolled back"
 
-        results[repo_name] = r.status_code
+    user_keys = iam.list_access_keys(UserName=username)
+    user_keys = user_keys["AccessKeyMetadata"]
 
-    return results
+    keys_deleted = 0
+
+    for key in user_keys:
+        if key["AccessKeyId"] == generated_key_id:
+            continue
+
+        iam.delete_access_key(UserName=username, AccessKeyId=key["AccessKeyId"])
+        keys_deleted += 1
+
+    return True, f"Removed {keys_deleted} old keys"
 
 
 def rollback_if_necessary(iam, keys, result_codes):
     click.echo("Results for each repository:")
 
-    success = True
-
-    click.echo(
-        "{0:<15}{1:<25}{2:<15}".format("REPOSITORY", "UPDATE STATUS (HTTP)", "STATUS")
-    )
-    for repo, code in result_codes.items():
-        status = None
-        username = f"ci-user-{repo}"
-        generated_key_id, _ = keys[repo]
-
-        if not 200 <= code <= 299:
-            iam.delete_access_key(UserName=username, AccessKeyId=generated_key_id)
-            status = "Key rolled back"
-            success = False
-        else:
-            user_keys = iam.list_access_keys(UserName=username)
-            user_keys = user_keys["AccessKeyMetadata"]
+    with ThreadPoolExecutor(max_workers=IAM_MAX_WORKERS) as executor:
+        futures = {
+            repo: executor.submit(
+                _finalize_access_keys, iam, repo, keys[repo][0], codes
+            )
+            for repo, codes in result_codes.items()
+        }
 
-            keys_deleted = 0
+    rows = []
+    row_success = []
 
-            for key in user_keys:
-                if key["AccessKeyId"] == generated_key_id:
-                    continue
+    for repo, future in futures.items():
+        try:
+            updated, status = future.result()
+        except Exception as e:
+            updated, status = False, f"Error: {e}"
 
-                iam.delete_access_key(UserName=username, AccessKeyId=key["AccessKeyId"])
-                keys_deleted += 1
+        rows.append([repo, *result_codes[repo].values(), status])
+        row_success.append(updated)
 
-            status = f"Removed {keys_deleted} old keys"
+    secret_names = next(iter(result_codes.values()), {}).keys()
+    table = tabulate(
+        rows, ["REPOSITORY", *secret_names, "STATUS"], tablefmt="simple"
+    ).splitlines()
 
-        click.echo(
-            click.style(
-                f"{repo:<15}{code:<25}{status:<15}",
-                fg="green" if 200 <= code <= 299 else "red",
-            )
-        )
+    # The first two lines are the header and its underline.
+    click.echo("\n".join(table[:2]))
+    for line, updated in zip(table[2:], row_success):
+        click.echo(click.style(line, fg="green" if updated else "red"))
 
-    return success
+    return all(row_success)
 
 
 def exclude_iac_from_rotation(repos, org_name):
@@ -256,14 +562,20 @@ def exclude_iac_from_rotation(repos, org_name):
     default="hms-dbmi-cellenics",
     help="The GitHub organization to perform the operation in.",
 )
-def rotate_ci(token, org):
+@click.option(
+    "--timeout",
+    default=DEFAULT_STACK_TIMEOUT,
+    show_default=True,
+    help="Seconds to wait for the CI users CloudFormation stack to be ready.",
+)
+def rotate_ci(token, org, timeout):
     """
     Rotates and updates repository access credentials.
     """
 
     click.echo("Logging into GitHub and getting all repositories...")
 
-    g = Github(token)
+    g = get_github(token)
     org = g.get_organization(org)
     repos = org.get_repos()
 
@@ -275,8 +587,7 @@ def rotate_ci(token, org):
 
     repos = exclude_iac_from_rotation(repos, org.login)
 
-    policies = [ret for ret in (filter_iam_repos(repo) for repo in repos) if ret]
-    policies = dict(policies)
+    policies = filter_iam_repos(repos, token, org.login)
 
     click.echo(
         f"Found {len(policies.keys())} repositories marked as requiring CI IAM "
@@ -295,8 +606,10 @@ def rotate_ci(token, org):
     if not answer["create"]:
         exit(1)
 
-    iam = boto3.client("iam", config=config)
-    create_new_iam_users(policies)
+    # IAM throttles bursts of requests, the shared client retries adaptively
+    # with enough connections for all workers.
+    iam = get_client("iam", region=AWS_REGION, max_pool_connections=IAM_MAX_WORKERS)
+    create_new_iam_users(policies, timeout=timeout)
     keys = create_new_access_keys(iam, policies)
 
     result_codes = update_github_secrets(keys, token, org)
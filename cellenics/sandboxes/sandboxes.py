@@ -0,0 +1,45 @@
+from fnmatch import fnmatch
+
+import click
+
+from ..utils.staging import list_sandboxes
+
+
+@click.command()
+@click.argument("patterns", nargs=-1)
+@click.option(
+    "--token",
+    "-t",
+    envvar="GITHUB_API_TOKEN",
+    required=True,
+    show_default=True,
+    help="A GitHub Personal Access Token with the required permissions.",
+)
+@click.option(
+    "--org",
+    envvar="GITHUB_CELLENICS_ORG",
+    default="hms-dbmi-cellenics",
+    show_default=True,
+    help="The GitHub organization to perform the operation in.",
+)
+def sandboxes(patterns, token, org):
+    """
+    Lists the staging environments currently deployed.
+
+    PATTERNS are optional shell-style patterns to filter the sandbox IDs by, e.g.:
+
+        cellenics sandboxes 'jdoe-*'
+    """
+
+    sandbox_ids = [
+        sandbox_id
+        for sandbox_id in list_sandboxes(org, token)
+        if not patterns or any(fnmatch(sandbox_id, pattern) for pattern in patterns)
+    ]
+
+    if not sandbox_ids:
+        click.echo(click.style("No staging sandboxes found.", fg="yellow"), err=True)
+        return
+
+    for sandbox_id in sandbox_ids:
+        click.echo(sandbox_id)
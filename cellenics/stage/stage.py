@@ -1,66 +1,119 @@
 import base64
 import hashlib
-import json
 import os
 import re
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 
 import anybase32
-import boto3
 import click
-import requests
-from github import Github
+from github.GithubException import UnknownObjectException
 from inquirer import Checkbox, Confirm, Text, prompt
 from inquirer.themes import GreenPassion
 from ruamel.yaml import YAML
 from ruamel.yaml.compat import StringIO
 
-from ..utils.staging import check_if_sandbox_exists
+from ..utils.github_api import (
+    dispatch_workflow,
+    get_default_branch_shas,
+    get_github,
+)
+from ..utils.http import get_session
+from ..utils.staging import check_if_sandbox_exists, encrypt_credentials
 
 SANDBOX_NAME_REGEX = re.compile(r"^[a-z0-9][-a-z0-9]*[a-z0-9]$")
+PLACEHOLDER_REGEX = re.compile(r"STAGING_SANDBOX_ID|STAGING_RDS_SANDBOX_ID")
 
 DEFAULT_BRANCH = "master"
 
+Deployment = namedtuple("Deployment", ["ref", "url", "status", "text"])
+
+yaml = YAML()
+
 
 def recursive_get(d, *keys):
     return reduce(lambda c, k: c.get(k, {}), keys, d)
 
 
+class HashingStream(StringIO):
+    """
+    A text stream that hashes everything written to it, so the manifests don't
+    have to be encoded again just to compute their hash.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.hash = hashlib.md5()
+
+    def write(self, s):
+        self.hash.update(s.encode())
+        return super().write(s)
+
+
 def get_manifests(templates, pins, token, repo_to_ref):
-    yaml = YAML()
-    manifests = []
+    """
+    Returns the manifests of all templates as a single YAML stream, along with
+    the MD5 digest of the stream.
+    """
 
-    # Open each template and iterate through the documents.
-    for name, template in templates.items():
-        documents = yaml.load_all(template.text)
-        for document in documents:
-            if name in pins:
-                # pin chart version if pinning is on
-                if document.get("kind") == "ImageUpdateAutomation":
-                    document["spec"]["suspend"] = True
+    documents = {
+        name: list(yaml.load_all(template.text)) for name, template in templates.items()
+    }
 
-                if document.get("kind") == "GitRepository":
-                    # Remove branch from ref, and use commit instead
-                    del document["spec"]["ref"]["branch"]
+    # Resolve the commits of all pinned repositories at once.
+    pinned_urls = [
+        document["spec"]["url"]
+        for name in pins
+        for document in documents[name]
+        if document.get("kind") == "GitRepository"
+    ]
+    pinned_shas = get_branch_refs(pinned_urls, token, repo_to_ref)
+
+    # Pin the documents of each pinned template.
+    for name, template_documents in documents.items():
+        if name not in pins:
+            continue
+
+        for document in template_documents:
+            # pin chart version if pinning is on
+            if document.get("kind") == "ImageUpdateAutomation":
+                document["spec"]["suspend"] = True
 
-                    document["spec"]["ref"]["commit"] = get_branch_ref(
-                        document["spec"]["url"],
-                        token,
-                        repo_to_ref=repo_to_ref,
-                        return_sha=True,
-                    )
+            if document.get("kind") == "GitRepository":
+                # Remove branch from ref, and use commit instead
+                del document["spec"]["ref"]["branch"]
 
-            manifests.append(document)
+                document["spec"]["ref"]["commit"] = pinned_shas[document["spec"]["url"]]
 
-    stream = StringIO()
-    yaml.dump_all(manifests, stream)
-    manifests = stream.getvalue()
+    # Documents are serialized and hashed in a single pass.
+    stream = HashingStream()
+    yaml.dump_all(
+        (document for docs in documents.values() for document in docs), stream
+    )
 
-    return manifests
+    return stream.getvalue(), stream.hash.digest()
 
 
-def download_templates(org, repo, ref):
+def render_manifests(manifests, sandbox_id, rds_sandbox_id):
+    """
+    Substitutes the sandbox placeholders in `manifests` in a single pass and
+    returns the result encoded in base64.
+    """
+
+    placeholders = {
+        "STAGING_SANDBOX_ID": sandbox_id,
+        "STAGING_RDS_SANDBOX_ID": rds_sandbox_id,
+    }
+
+    manifests = PLACEHOLDER_REGEX.sub(
+        lambda match: placeholders[match.group()], manifests
+    )
+
+    return base64.b64encode(manifests.encode()).decode()
+
+
+def download_templates(org, repo, ref, session=None):
     # If no pull request ID was specified in the command.
     if isinstance(ref, int):
         template = f"refs-pull-{ref}-merge.yaml"
@@ -74,9 +127,8 @@ def download_templates(org, repo, ref):
         f"staging-candidates/{repo}/{template}"
     )
 
-    s = requests.Session()
-    r = s.get(url)
-    Deployment = namedtuple("Deployment", ["ref", "url", "status", "text"])
+    session = session or get_session()
+    r = session.get(url)
 
     return Deployment(
         ref=ref or DEFAULT_BRANCH, url=url, status=r.status_code, text=r.text
@@ -100,9 +152,16 @@ def compile_requirements(org, deployments):
         except ValueError:
             repo_to_ref[repo] = ref
 
-    templates = {}
-    for repo, ref in repo_to_ref.items():
-        templates[repo] = download_templates(org, repo, ref)
+    # Fetch all manifests concurrently over the same pooled session, so we only
+    # wait as long as the slowest download.
+    session = get_session()
+    with ThreadPoolExecutor(max_workers=len(repo_to_ref)) as executor:
+        futures = {
+            repo: executor.submit(download_templates, org, repo, ref, session)
+            for repo, ref in repo_to_ref.items()
+        }
+
+    templates = {repo: future.result() for repo, future in futures.items()}
 
     click.echo(
         click.style(
@@ -142,6 +201,15 @@ def compile_requirements(org, deployments):
     return templates, repo_to_ref
 
 
+def _parse_chart_url(chart_url):
+    # A `git` reference can be https://github.com/hms-dbmi-cellenics/releases
+    # Here we extract the repository and organization from the string.
+    path = chart_url.split(":")
+    org, repo_name = path[1].split("/")[-2:]
+
+    return org, repo_name
+
+
 def get_branch_ref(chart_url, token, repo_to_ref=None, return_sha=False):
     """
     Get a reference to a branch given the chart information (git, path, ref)
@@ -157,14 +225,9 @@ def get_branch_ref(chart_url, token, repo_to_ref=None, return_sha=False):
     branch. If it is False, it returns the name of the default branch.
     """
 
-    # A `git` reference can be https://github.com/hms-dbmi-cellenics/releases
-    # Here we extract the repository and organization from the string.
-    path = chart_url.split(":")
-    org, repo_name = path[1].split("/")[-2:]
+    org, repo_name = _parse_chart_url(chart_url)
 
-    g = Github(token)
-    org = g.get_organization(org)
-    repo = org.get_repo(repo_name)
+    repo = get_github(token).get_repo(f"{org}/{repo_name}")
 
     # Here we check if the PR to get is designated when creating the staging environment
     if not isinstance(repo_to_ref.get(repo_name), int):
@@ -175,16 +238,47 @@ def get_branch_ref(chart_url, token, repo_to_ref=None, return_sha=False):
     if not return_sha:
         return target_branch
 
-    for ref in repo.get_git_refs():
-        if ref.ref == f"refs/heads/{target_branch}":
-            return ref.object.sha
+    try:
+        ref = repo.get_git_ref(f"heads/{target_branch}")
+    except UnknownObjectException:
+        raise Exception("Invalid repository supplied.")
+
+    return ref.object.sha
+
+
+def get_branch_refs(chart_urls, token, repo_to_ref):
+    """
+    Returns a dictionary mapping each of `chart_urls` to the SHA at the head of
+    the default branch of its repository.
+
+    The default branches of all repositories are resolved in a single GraphQL
+    query. Repositories staged from a pull request fall back to `get_branch_ref`.
+    """
+
+    repos = {chart_url: _parse_chart_url(chart_url) for chart_url in chart_urls}
 
-    raise Exception("Invalid repository supplied.")
+    on_default_branch = {
+        chart_url: repo
+        for chart_url, repo in repos.items()
+        if not isinstance(repo_to_ref.get(repo[1]), int)
+    }
+
+    shas = get_default_branch_shas(token, set(on_default_branch.values()))
+
+    refs = {}
+    for chart_url, repo in repos.items():
+        if chart_url in on_default_branch:
+            refs[chart_url] = shas[repo]
+        else:
+            refs[chart_url] = get_branch_ref(
+                chart_url, token, repo_to_ref=repo_to_ref, return_sha=True
+            )
 
+    return refs
 
-def get_sandbox_id(templates, manifests, org, auto=False):
+
+def get_sandbox_id(templates, manifest_hash, org, token, auto=False):
     # Generate a sandbox name and ask the user what they want theirs to be called.
-    manifest_hash = hashlib.md5(manifests.encode()).digest()
     manifest_hash = anybase32.encode(manifest_hash, anybase32.ZBASE32).decode()
     pr_ids = "-".join(
         [
@@ -240,7 +334,7 @@ def get_sandbox_id(templates, manifests, org, auto=False):
             click.echo(click.style("Check the syntax of your sandbox id.", fg="red"))
             continue
 
-        if check_if_sandbox_exists(org, sandbox_id):
+        if check_if_sandbox_exists(org, sandbox_id, token):
             click.echo(click.style("A sandbox with this ID exists.", fg="red"))
             continue
 
@@ -309,18 +403,16 @@ def create_manifest(templates, token, org, repo_to_ref, auto=False, with_rds=Fal
 
     # Find the latest SHA of the iac
     # Generate a list of manifests from all the url's we collected.
-    manifests = get_manifests(templates, pins, token, repo_to_ref)
+    manifests, manifest_hash = get_manifests(templates, pins, token, repo_to_ref)
 
     # Write sandbox ID
-    sandbox_id = get_sandbox_id(templates, manifests, org, auto=auto)
+    sandbox_id = get_sandbox_id(templates, manifest_hash, org, token, auto=auto)
 
     # Decide the RDS cluster ID
     rds_sandbox_id = sandbox_id if with_rds else "default"
 
     click.echo()
-    manifests = manifests.replace("STAGING_SANDBOX_ID", sandbox_id)
-    manifests = manifests.replace("STAGING_RDS_SANDBOX_ID", rds_sandbox_id)
-    manifests = base64.b64encode(manifests.encode()).decode()
+    manifests = render_manifests(manifests, sandbox_id, rds_sandbox_id)
 
     return manifests, sandbox_id
 
@@ -383,23 +475,7 @@ def stage(token, org, deployments, with_rds, auto):
     click.echo()
     click.echo(f"Sandbox ID: {sandbox_id}")
 
-    # get (secret) access keys
-    session = boto3.Session()
-    credentials = session.get_credentials()
-    credentials = credentials.get_frozen_credentials()
-
-    credentials = {
-        "access_key": credentials.access_key,
-        "secret_key": credentials.secret_key,
-        "github_api_token": token,
-    }
-
-    # encrypt (secret) access keys
-    kms = boto3.client("kms")
-    secrets = kms.encrypt(
-        KeyId="alias/iac-secret-key", Plaintext=json.dumps(credentials).encode()
-    )
-    secrets = base64.b64encode(secrets["CiphertextBlob"]).decode()
+    secrets = encrypt_credentials(token)
 
     if not auto:
         questions = [
@@ -414,18 +490,11 @@ def stage(token, org, deployments, with_rds, auto):
         if not answer["create"]:
             exit(1)
 
-    g = Github(token)
-    o = g.get_organization(org)
-    r = o.get_repo("iac")
-
-    wf = None
-    for workflow in r.get_workflows():
-        if workflow.name == "Deploy a staging environment":
-            wf = str(workflow.id)
-
-    wf = r.get_workflow(wf)
-
-    workflow_started = wf.create_dispatch(
+    workflow_started = dispatch_workflow(
+        token,
+        org,
+        "iac",
+        "Deploy a staging environment",
         ref="master",
         inputs={
             "manifest": manifest,
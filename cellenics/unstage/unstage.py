@@ -1,17 +1,43 @@
-import base64
-import json
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
 
-import boto3
 import click
-from github import Github
 from inquirer import Confirm, prompt
 from inquirer.themes import GreenPassion
 
-from ..utils.staging import check_if_sandbox_exists
+from ..utils.github_api import dispatch_workflow
+from ..utils.staging import encrypt_credentials, list_sandboxes
+
+MAX_WORKERS = 8
+
+
+def _is_pattern(sandbox_id):
+    return any(char in sandbox_id for char in "*?[")
+
+
+def _resolve_sandbox_ids(token, org, sandbox_ids):
+    """
+    Expands patterns against the sandboxes currently staged and checks that the
+    remaining sandbox IDs exist. Returns the existing and the missing IDs.
+    """
+    staged = list_sandboxes(org, token)
+
+    existing = []
+    missing = []
+
+    for sandbox_id in dict.fromkeys(sandbox_ids):
+        if _is_pattern(sandbox_id):
+            existing += [s for s in staged if fnmatch(s, sandbox_id)]
+        elif sandbox_id in staged:
+            existing.append(sandbox_id)
+        else:
+            missing.append(sandbox_id)
+
+    return list(dict.fromkeys(existing)), missing
 
 
 @click.command()
-@click.argument("sandbox_id", nargs=1)
+@click.argument("sandbox_ids", nargs=-1, required=True)
 @click.option(
     "--token",
     "-t",
@@ -27,75 +53,89 @@ from ..utils.staging import check_if_sandbox_exists
     show_default=True,
     help="The GitHub organization to perform the operation in.",
 )
-def unstage(token, org, sandbox_id):
+def unstage(token, org, sandbox_ids):
     """
-    Removes a custom staging environment.
-    """
-
-    if check_if_sandbox_exists(org, sandbox_id):
-        # get (secret) access keys
-        session = boto3.Session()
-        credentials = session.get_credentials()
-        credentials = credentials.get_frozen_credentials()
-
-        credentials = {
-            "access_key": credentials.access_key,
-            "secret_key": credentials.secret_key,
-            "github_api_token": token,
-        }
-
-        # encrypt (secret) access keys
-        kms = boto3.client("kms")
-        secrets = kms.encrypt(
-            KeyId="alias/iac-secret-key", Plaintext=json.dumps(credentials).encode()
-        )
-        secrets = base64.b64encode(secrets["CiphertextBlob"]).decode()
-
-        questions = [
-            Confirm(
-                "delete",
-                default=False,
-                message="Are you sure you want to remove the sandbox "
-                f"with ID `{sandbox_id}`. This cannot be undone.",
-            )
-        ]
-        click.echo()
-        answers = prompt(questions, theme=GreenPassion())
-        if not answers["delete"]:
-            exit(1)
+    Removes custom staging environments.
 
-        g = Github(token)
-        o = g.get_organization(org)
-        r = o.get_repo("iac")
+    SANDBOX_IDS can be sandbox IDs or shell-style patterns matched against the
+    sandboxes currently staged, e.g.:
 
-        wf = None
-        for workflow in r.get_workflows():
-            if workflow.name == "Remove a staging environment":
-                wf = str(workflow.id)
-
-        wf = r.get_workflow(wf)
+        cellenics unstage my-sandbox-id 'jdoe-*'
+    """
 
-        wf.create_dispatch(
-            ref="master",
-            inputs={"sandbox-id": sandbox_id, "secrets": secrets},
-        )
+    sandbox_ids, missing = _resolve_sandbox_ids(token, org, sandbox_ids)
 
+    for sandbox_id in missing:
         click.echo()
         click.echo(
             click.style(
-                "✔️ Removal submitted. You can check your progress at "
-                f"https://github.com/{org}/iac/actions",
-                fg="green",
+                f"Staging sandbox with ID `{sandbox_id}` could not be found.",
+                fg="yellow",
                 bold=True,
             )
         )
 
-    else:
-        click.echo()
-        click.echo(
-            click.style(
-                f"Staging sandbox with ID `{sandbox_id}` could not be found.",
-                fg="yellow",
-                bold=True,
+    if not sandbox_ids:
+        return
+
+    # The same encrypted credentials are valid for every removal.
+    secrets = encrypt_credentials(token)
+
+    sandbox_list = "\n".join(f"  - {sandbox_id}" for sandbox_id in sandbox_ids)
+    questions = [
+        Confirm(
+            "delete",
+            default=False,
+            message="Are you sure you want to remove the following sandboxes? "
+            f"This cannot be undone.\n{sandbox_list}\n",
+        )
+    ]
+    click.echo()
+    answers = prompt(questions, theme=GreenPassion())
+    if not answers["delete"]:
+        exit(1)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            sandbox_id: executor.submit(
+                dispatch_workflow,
+                token,
+                org,
+                "iac",
+                "Remove a staging environment",
+                ref="master",
+                inputs={"sandbox-id": sandbox_id, "secrets": secrets},
+            )
+            for sandbox_id in sandbox_ids
+        }
+
+    failed = False
+
+    click.echo()
+    for sandbox_id, future in futures.items():
+        try:
+            submitted = future.result()
+        except Exception as e:
+            click.echo(click.style(f"✖️ {sandbox_id}: {e}", fg="red"))
+            failed = True
+            continue
+
+        if submitted:
+            click.echo(f"✔️ Removal of {sandbox_id} submitted.")
+        else:
+            click.echo(
+                click.style(f"✖️ Removal of {sandbox_id} was not accepted.", fg="red")
             )
+            failed = True
+
+    click.echo()
+    click.echo(
+        click.style(
+            f"You can check your progress at https://github.com/{org}/iac/actions",
+            fg="green",
+            bold=True,
         )
+    )
+
+    if failed:
+        exit(1)
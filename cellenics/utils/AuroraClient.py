@@ -1,31 +1,59 @@
 import json
+import os
+import signal
 import socket
 import sys
-from contextlib import closing
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+from fnmatch import fnmatchcase
 from subprocess import run as sub_run
 
-import boto3
-
 from ..rds.tunnel import close_tunnel as close_tunnel_cmd
 from ..rds.tunnel import open_tunnel as open_tunnel_cmd
+from .aws import get_client
+from .tracing import span, traced
 
 # we use writer because reader might also point to writer making it not safe
 ENDPOINT_TYPE = "writer"
 
-
-def _run_rds_command(
-    command,
-    sandbox_id,
-    input_env,
-    user,
-    region,
-    aws_profile,
-    local_port=None,
-    capture_output=False,
-    verbose=True,
+DATABASE = "aurora_db"
+
+# Queries running for longer than this are cancelled by the server. Any value
+# accepted by `statement_timeout` works, 0 (the default) disables it.
+QUERY_TIMEOUT = os.getenv("CELLENICS_QUERY_TIMEOUT", "0")
+
+# If set, the plan of every `select` is appended to this file as JSON lines.
+# Plans come from EXPLAIN ANALYZE, so every query runs a second time.
+EXPLAIN_FILE = os.getenv("CELLENICS_EXPLAIN_FILE")
+
+_explain_lock = threading.Lock()
+
+# Largest tables first, so callers processing them in parallel don't end up
+# with the biggest ones running alone. Row counts are the planner's estimates.
+# The tables are aggregated into a single row, so an empty database still
+# returns one, with an empty list.
+LIST_TABLES = """
+    SELECT COALESCE(json_agg(t ORDER BY t.bytes DESC), '[]'::json) AS tables
+    FROM (
+        SELECT n.nspname AS schema, c.relname AS name,
+            quote_ident(n.nspname) || '.' || quote_ident(c.relname) AS qualified_name,
+            pg_total_relation_size(c.oid) AS bytes,
+            NULLIF(c.reltuples, -1)::bigint AS estimated_rows
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'r'
+            AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+    ) AS t
+"""
+
+
+def _get_credentials(
+    sandbox_id, input_env, user, region, aws_profile, local_port=None, verbose=True
 ):
-    aws_session = boto3.Session(profile_name=aws_profile, region_name=region)
-
+    """
+    Returns the password and local port to connect to the database with.
+    """
     password = None
 
     if input_env == "development":
@@ -34,7 +62,7 @@ def _run_rds_command(
     else:
         local_port = local_port or 5432
 
-        rds_client = aws_session.client("rds")
+        rds_client = get_client("rds", aws_profile, region)
 
         remote_endpoint = _get_rds_endpoint(
             input_env, sandbox_id, rds_client, ENDPOINT_TYPE
@@ -53,28 +81,53 @@ def _run_rds_command(
     if verbose:
         print("Token generated", file=sys.stderr)
 
+    return password, local_port
+
+
+@traced("rds")
+def _run_rds_command(
+    command,
+    sandbox_id,
+    input_env,
+    user,
+    region,
+    aws_profile,
+    local_port=None,
+    capture_output=False,
+    verbose=True,
+    env=None,
+):
+    password, local_port = _get_credentials(
+        sandbox_id, input_env, user, region, aws_profile, local_port, verbose
+    )
+
+    env = {**os.environ, **env} if env else None
+
     result = None
 
-    if capture_output:
-        result = sub_run(
-            f'PGPASSWORD="{password}" {command} \
-                --host=localhost \
-                --port={local_port} \
-                --username={user} \
-                --dbname=aurora_db',
-            capture_output=True,
-            text=True,
-            shell=True,
-        )
-    else:
-        result = sub_run(
-            f'PGPASSWORD="{password}" {command} \
-                --host=localhost \
-                --port={local_port} \
-                --username={user} \
-                --dbname=aurora_db',
-            shell=True,
-        )
+    with span("rds", "subprocess", command=command.split()[0]):
+        if capture_output:
+            result = sub_run(
+                f'PGPASSWORD="{password}" {command} \
+                    --host=localhost \
+                    --port={local_port} \
+                    --username={user} \
+                    --dbname={DATABASE}',
+                capture_output=True,
+                text=True,
+                shell=True,
+                env=env,
+            )
+        else:
+            result = sub_run(
+                f'PGPASSWORD="{password}" {command} \
+                    --host=localhost \
+                    --port={local_port} \
+                    --username={user} \
+                    --dbname={DATABASE}',
+                shell=True,
+                env=env,
+            )
 
     if result.returncode != 0:
         raise Exception(result.stderr)
@@ -109,12 +162,36 @@ def _process_output_as_json(query_result):
     return json.loads(json_text)
 
 
+def _describe(query, length=60):
+    query = " ".join(query.split())
+    return query if len(query) <= length else f"{query[:length - 3]}..."
+
+
+def _query_env(application_name, timeout):
+    # Options set by the caller, like a search_path, are kept.
+    options = os.getenv("PGOPTIONS", "")
+    if timeout and timeout != "0":
+        options = f"{options} -c statement_timeout={timeout}".strip()
+
+    return {"PGAPPNAME": application_name, "PGOPTIONS": options}
+
+
+def _matches(table, patterns):
+    names = (table["name"], f"{table['schema']}.{table['name']}")
+    return any(fnmatchcase(name, pattern) for name in names for pattern in patterns)
+
+
 def _find_free_port():
+    # Binding, rather than connecting, also skips ports that are held without
+    # being listened on.
     for port in range(5432, 6000):
         with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
-            res = sock.connect_ex(("localhost", port))
-            if res != 0:
-                return port
+            try:
+                sock.bind(("localhost", port))
+            except OSError:
+                continue
+
+            return port
 
 
 class AuroraClient:
@@ -144,6 +221,30 @@ class AuroraClient:
             self.env, self.region, self.sandbox_id, self.local_port, self.aws_profile
         )
 
+    def connection_params(self):
+        """
+        Returns the libpq environment variables to connect to the database
+        through the tunnel. IAM tokens expire after 15 minutes, so long-running
+        callers should ask for new ones for every connection.
+        """
+        password, local_port = _get_credentials(
+            self.sandbox_id,
+            self.env,
+            self.user,
+            self.region,
+            self.aws_profile,
+            local_port=self.local_port,
+            verbose=False,
+        )
+
+        return {
+            "PGHOST": "localhost",
+            "PGPORT": str(local_port),
+            "PGUSER": self.user,
+            "PGPASSWORD": password,
+            "PGDATABASE": DATABASE,
+        }
+
     def run_query(self, query, capture_output=True, verbose=False):
         return _run_rds_command(
             query,
@@ -157,24 +258,143 @@ class AuroraClient:
             verbose=verbose,
         )
 
-    def select(self, query, as_json=True):
-        query = f"""psql -c "SELECT {"json_agg(q)" if as_json else "q" }
-                             FROM ( {query} ) AS q" """
-
-        return _process_output_as_json(
-            _run_rds_command(
-                query,
-                self.sandbox_id,
-                self.env,
-                self.user,
-                self.region,
-                self.aws_profile,
-                local_port=self.local_port,
-                capture_output=True,
-                verbose=False,
+    def select(self, query, as_json=True, timeout=QUERY_TIMEOUT):
+        """
+        Runs `query` and returns its rows, aggregated into JSON by default.
+
+        The server cancels the query if it runs for longer than `timeout`, or
+        if the CLI is interrupted. The latency of every query is traced.
+        """
+        name = _describe(query)
+        query = f"""SELECT {"json_agg(q)" if as_json else "q" }
+                    FROM ( {query} ) AS q"""
+
+        # A unique application name lets the query be found to cancel it.
+        application_name = f"cellenics-{uuid.uuid4().hex[:12]}"
+        env = _query_env(application_name, timeout)
+
+        start = time.perf_counter()
+
+        with span("rds", name), self._cancel_on_interrupt(application_name):
+            output = self._psql(query, env)
+
+        if EXPLAIN_FILE:
+            self._explain(query, time.perf_counter() - start, env)
+
+        return _process_output_as_json(output)
+
+    def _psql(self, query, env, flags=""):
+        return _run_rds_command(
+            f'psql {flags} -c "{query}"',
+            self.sandbox_id,
+            self.env,
+            self.user,
+            self.region,
+            self.aws_profile,
+            local_port=self.local_port,
+            capture_output=True,
+            verbose=False,
+            env=env,
+        )
+
+    def _cancel(self, application_name):
+        try:
+            self._psql(
+                "SELECT pg_cancel_backend(pid) FROM pg_stat_activity "
+                f"WHERE application_name = '{application_name}'",
+                _query_env(f"{application_name}-cancel", None),
             )
+        except Exception as e:
+            print(f"Could not cancel the running query: {e}", file=sys.stderr)
+
+    @contextmanager
+    def _cancel_on_interrupt(self, application_name):
+        """
+        Cancels the query running as `application_name` on Ctrl-C, before the
+        previous handler gets to close the tunnel.
+        """
+        # Signal handlers can only be set from the main thread.
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        previous = signal.getsignal(signal.SIGINT)
+
+        # Ignored interrupts must not cancel anything, and a handler that was
+        # not set from Python could not be put back.
+        if previous in (signal.SIG_IGN, None):
+            yield
+            return
+
+        def handler(signum, frame):
+            signal.signal(signal.SIGINT, previous)
+            self._cancel(application_name)
+
+            if previous == signal.SIG_DFL:
+                # Deliver the signal again, so the process ends as it would have.
+                os.kill(os.getpid(), signum)
+            else:
+                previous(signum, frame)
+
+        signal.signal(signal.SIGINT, handler)
+
+        try:
+            yield
+        finally:
+            signal.signal(signal.SIGINT, previous)
+
+    def _explain(self, query, seconds, env):
+        plan = self._psql(
+            f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", env, flags="-At"
         )
 
+        with _explain_lock, open(EXPLAIN_FILE, "a") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "query": " ".join(query.split()),
+                        "seconds": round(seconds, 3),
+                        "plan": json.loads(plan),
+                    }
+                )
+                + "\n"
+            )
+
+    def list_tables(self, tables=(), exclude_tables=()):
+        """
+        Returns the tables in the database matching any of the `tables` patterns,
+        or all of them if none are given, and none of `exclude_tables`. Patterns
+        match either the table name or `schema.table`.
+        """
+        return [
+            table
+            for table in self.select(LIST_TABLES)[0]["tables"]
+            if (not tables or _matches(table, tables))
+            and not _matches(table, exclude_tables)
+        ]
+
+    def count_rows(self, tables):
+        """
+        Returns the exact number of rows of each of `tables`, as returned by
+        `list_tables`, keyed by `(schema, name)`. They are all counted in a
+        single query, so the counts come from the same snapshot.
+        """
+        if not tables:
+            return {}
+
+        # Quoted identifiers must be escaped for the shell psql runs in.
+        query = " UNION ALL ".join(
+            f"SELECT {i} AS i, count(*) AS row_count FROM {table['qualified_name']}"
+            for i, table in enumerate(tables)
+        ).replace('"', '\\"')
+
+        return {
+            (tables[row["i"]]["schema"], tables[row["i"]]["name"]): row["row_count"]
+            for row in self.select(query)
+        }
+
     def close_tunnel(self):
-        close_tunnel_cmd()
+        if self.local_port is not None:
+            close_tunnel_cmd(self.local_port)
+
         self.local_port = None
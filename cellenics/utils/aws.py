@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+from functools import lru_cache
+
+import boto3
+from botocore.config import Config
+
+from .cache import read_cache, write_cache
+from .tracing import trace_client
+
+# Adaptive retries back off on throttling errors and rate-limit the client
+# itself, so parallel workloads slow down instead of failing.
+AWS_MAX_ATTEMPTS = int(os.getenv("CELLENICS_AWS_MAX_ATTEMPTS", "10"))
+
+# Matches the default concurrency of boto3 transfers. Callers running more
+# threads against the same client should ask for a larger pool.
+DEFAULT_POOL_SIZE = 10
+
+# The account and region a profile resolves to are cached on disk, so commands
+# that only need them to build resource names skip STS.
+IDENTITY_CACHE = "aws-identity"
+IDENTITY_TTL = 60 * 60
+
+# Creating clients from a session is not thread-safe.
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_session(profile=None, region=None):
+    """
+    Returns the boto3 session for the given profile and region, shared by the
+    whole process so credentials are only resolved once.
+    """
+    return boto3.Session(profile_name=profile, region_name=region)
+
+
+@lru_cache(maxsize=None)
+def get_session_client(session, service, max_pool_connections=None):
+    """
+    Returns a boto3 client for `service` created from `session`, shared by all
+    callers asking for the same session and pool size. Clients are thread-safe,
+    so this also means they share their connection pool.
+    """
+    config = Config(
+        retries={"mode": "adaptive", "max_attempts": AWS_MAX_ATTEMPTS},
+        max_pool_connections=max_pool_connections or DEFAULT_POOL_SIZE,
+    )
+
+    with _lock:
+        client = session.client(service, config=config)
+
+    return trace_client(client)
+
+
+def get_client(service, profile=None, region=None, max_pool_connections=None):
+    """
+    Returns the shared boto3 client for `service` in the given profile and
+    region, see `get_session_client`.
+    """
+    return get_session_client(
+        get_session(profile, region), service, max_pool_connections
+    )
+
+
+@lru_cache(maxsize=None)
+def get_identity(profile=None):
+    """
+    Returns the account ID and region the given profile resolves to.
+    """
+    session = get_session(profile)
+
+    # The environment can point the default chain at different credentials.
+    cache_key = json.dumps(
+        [
+            profile or os.getenv("AWS_PROFILE"),
+            os.getenv("AWS_ACCESS_KEY_ID"),
+            session.region_name,
+        ]
+    )
+
+    identity = read_cache(IDENTITY_CACHE, cache_key, IDENTITY_TTL)
+    if identity:
+        return identity["account_id"], identity["region"]
+
+    account_id = get_session_client(session, "sts").get_caller_identity()["Account"]
+
+    write_cache(
+        IDENTITY_CACHE,
+        cache_key,
+        {"account_id": account_id, "region": session.region_name},
+    )
+
+    return account_id, session.region_name
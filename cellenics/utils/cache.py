@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+CACHE_LOCATION = os.getenv(
+    "CELLENICS_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "cellenics")
+)
+
+
+def _cache_path(namespace, key):
+    # Keys may contain URLs or other sensitive material, so only their hash
+    # ends up on disk.
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return Path(CACHE_LOCATION) / namespace / f"{digest}.json"
+
+
+def read_cache(namespace, key, max_age=None):
+    """
+    Returns the value stored under `key` in `namespace`, or None if there is no
+    such value or it is older than `max_age` seconds.
+    """
+    path = _cache_path(namespace, key)
+
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if max_age is not None and time.time() - entry["created_at"] > max_age:
+        return None
+
+    return entry["value"]
+
+
+def write_cache(namespace, key, value):
+    """
+    Stores the JSON-serializable `value` under `key` in `namespace`.
+
+    Cache files are only readable by the current user. Failing to write to the
+    cache is never fatal, the next read will simply miss.
+    """
+    path = _cache_path(namespace, key)
+
+    try:
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+        # mkstemp creates the file with 0600 permissions, and replacing it
+        # atomically means concurrent readers never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"created_at": time.time(), "value": value}, f)
+
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def delete_cache(namespace, key):
+    try:
+        _cache_path(namespace, key).unlink()
+    except OSError:
+        pass
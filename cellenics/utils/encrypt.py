@@ -1,10 +1,29 @@
 from base64 import b64encode
+from functools import lru_cache
 
 from nacl import encoding, public
 
 
-def encrypt(public_key, secret_value):
+@lru_cache(maxsize=None)
+def _get_sealed_box(public_key):
     public_key = public.PublicKey(public_key.encode("utf-8"), encoding.Base64Encoder())
-    sealed_box = public.SealedBox(public_key)
+    return public.SealedBox(public_key)
+
+
+def encrypt(public_key, secret_value):
+    sealed_box = _get_sealed_box(public_key)
     encrypted = sealed_box.encrypt(secret_value.encode("utf-8"))
     return b64encode(encrypted).decode("utf-8")
+
+
+def encrypt_all(public_key, secrets):
+    """
+    Encrypts each value in the `secrets` dictionary with the same public key,
+    which is only decoded once. Returns a dictionary with the same keys.
+    """
+    sealed_box = _get_sealed_box(public_key)
+
+    return {
+        name: b64encode(sealed_box.encrypt(value.encode("utf-8"))).decode("utf-8")
+        for name, value in secrets.items()
+    }
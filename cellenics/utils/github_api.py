@@ -0,0 +1,210 @@
+import os
+from functools import lru_cache
+
+import backoff
+from github import Github
+from github.Requester import (
+    HTTPRequestsConnectionClass,
+    HTTPSRequestsConnectionClass,
+    Requester,
+)
+
+from .http import get_session
+
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+
+
+class SharedSessionHTTPSConnection(HTTPSRequestsConnectionClass):
+    """
+    The connection PyGithub uses to talk to the API, sending requests through
+    the shared session so they are pooled and cached like any other.
+
+    PyGithub creates a new connection for every request once its connection
+    classes are injected. As they hold no state of their own, the client can
+    safely be used from several threads.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.session = get_session()
+
+    def close(self):
+        # The shared session outlives any single request.
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_github(token):
+    """
+    Returns a single authenticated PyGithub client per token, so that commands
+    touching several repositories don't re-authenticate for each of them.
+    """
+    Requester.injectConnectionClasses(
+        HTTPRequestsConnectionClass, SharedSessionHTTPSConnection
+    )
+
+    return Github(token)
+
+
+def _auth_headers(token):
+    return {"Authorization": f"token {token}"}
+
+
+def _is_rate_limited(response):
+    # Secondary rate limits are reported as 403s with a `Retry-After` header, or
+    # with no requests remaining in the current window.
+    return response.status_code == 403 and (
+        "Retry-After" in response.headers
+        or response.headers.get("X-RateLimit-Remaining") == "0"
+    )
+
+
+def _retry_after(response):
+    try:
+        return int(response.headers.get("Retry-After", 60))
+    except ValueError:
+        return 60
+
+
+@backoff.on_predicate(
+    backoff.runtime,
+    predicate=_is_rate_limited,
+    value=_retry_after,
+    jitter=None,
+    max_tries=3,
+)
+def github_request(method, url, token, **kwargs):
+    """
+    Makes an authenticated request to the GitHub API through the shared session.
+
+    Transient errors are retried by the session itself; this also waits out
+    secondary rate limits, which GitHub reports as 403s.
+    """
+    return get_session().request(method, url, headers=_auth_headers(token), **kwargs)
+
+
+def graphql_with_errors(token, query, variables=None):
+    """
+    Runs a GraphQL query against the GitHub API and returns its `data` along
+    with its `errors`, so the fields that did resolve can still be used.
+
+    Raises if the query produced no data at all.
+    """
+    r = github_request(
+        "POST",
+        f"{GITHUB_API_URL}/graphql",
+        token,
+        json={"query": query, "variables": variables or {}},
+    )
+    r.raise_for_status()
+
+    response = r.json()
+    errors = response.get("errors") or []
+
+    if response.get("data") is None:
+        messages = "; ".join(error["message"] for error in errors)
+        raise Exception(f"GitHub GraphQL query failed: {messages}")
+
+    return response["data"], errors
+
+
+def graphql(token, query, variables=None):
+    """
+    Runs a GraphQL query against the GitHub API and returns its `data`.
+    """
+    data, errors = graphql_with_errors(token, query, variables)
+
+    if errors:
+        messages = "; ".join(error["message"] for error in errors)
+        raise Exception(f"GitHub GraphQL query failed: {messages}")
+
+    return data
+
+
+def get_default_branch_shas(token, repos):
+    """
+    Resolves the SHA at the head of the default branch for each `(org, name)`
+    tuple in `repos` with a single GraphQL query.
+
+    Returns a dictionary mapping each `(org, name)` tuple to its SHA.
+    """
+    repos = list(repos)
+
+    if not repos:
+        return {}
+
+    params = []
+    fields = []
+    variables = {}
+
+    for i, (org, name) in enumerate(repos):
+        params.append(f"$o{i}: String!, $n{i}: String!")
+        fields.append(
+            f"r{i}: repository(owner: $o{i}, name: $n{i}) "
+            "{ defaultBranchRef { target { oid } } }"
+        )
+        variables[f"o{i}"] = org
+        variables[f"n{i}"] = name
+
+    query = f"query({', '.join(params)}) {{ {' '.join(fields)} }}"
+    data = graphql(token, query, variables)
+
+    shas = {}
+    for i, repo in enumerate(repos):
+        branch = (data.get(f"r{i}") or {}).get("defaultBranchRef")
+
+        if not branch:
+            raise Exception("Invalid repository supplied.")
+
+        shas[repo] = branch["target"]["oid"]
+
+    return shas
+
+
+def _get_workflow_index(token, org, repo):
+    # The listing is kept in the HTTP cache, so this is a single conditional
+    # request answered with 304 unless the workflows of the repository changed.
+    r = github_request(
+        "GET",
+        f"{GITHUB_API_URL}/repos/{org}/{repo}/actions/workflows",
+        token,
+        params={"per_page": 100},
+    )
+    r.raise_for_status()
+
+    return {workflow["name"]: workflow["id"] for workflow in r.json()["workflows"]}
+
+
+def get_workflow_id(token, org, repo, name):
+    """
+    Returns the ID of the workflow called `name` in `org/repo`.
+
+    IDs are looked up in the workflow listing of the repository, which is
+    revalidated with GitHub on every use.
+    """
+    index = _get_workflow_index(token, org, repo)
+
+    if name not in index:
+        raise Exception(f"Workflow `{name}` could not be found in {org}/{repo}.")
+
+    return index[name]
+
+
+def dispatch_workflow(token, org, repo, name, ref, inputs):
+    """
+    Triggers a `workflow_dispatch` event for the workflow called `name`.
+
+    Returns True if the workflow was started.
+    """
+    workflow_id = get_workflow_id(token, org, repo, name)
+
+    r = github_request(
+        "POST",
+        f"{GITHUB_API_URL}/repos/{org}/{repo}/actions/workflows/"
+        f"{workflow_id}/dispatches",
+        token,
+        json={"ref": ref, "inputs": inputs},
+    )
+
+    return r.status_code == 204
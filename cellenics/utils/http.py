@@ -0,0 +1,129 @@
+import base64
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cache import read_cache, write_cache
+from .tracing import span
+
+# Transient statuses worth retrying against GitHub and raw.githubusercontent.com
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+POOL_SIZE = 16
+
+HTTP_CACHE = "http"
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    An `HTTPAdapter` that keeps an on-disk copy of every GET response carrying
+    an `ETag` or `Last-Modified` header.
+
+    Subsequent requests for the same resource are made conditional, and a
+    `304 Not Modified` answer is replaced by the stored response. GitHub does
+    not count conditional requests answered with 304 against the rate limit.
+    """
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+
+        with span("http", f"{request.method} {url.netloc}", path=url.path) as args:
+            response = self._send(request, **kwargs)
+            args["status"] = response.status_code
+            args["from_cache"] = response.from_cache
+
+        return response
+
+    def _send(self, request, **kwargs):
+        if request.method != "GET":
+            response = super().send(request, **kwargs)
+            response.from_cache = False
+            return response
+
+        # Responses depend on who is asking and in what format, so both the
+        # credentials and the accepted media type are part of the key.
+        key = " ".join(
+            [
+                request.url,
+                request.headers.get("Authorization", ""),
+                request.headers.get("Accept", ""),
+            ]
+        )
+
+        cached = read_cache(HTTP_CACHE, key)
+
+        if cached:
+            if cached.get("etag"):
+                request.headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                request.headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 304 and cached:
+            response.status_code = cached["status"]
+            response.headers.update(cached["headers"])
+            response._content = base64.b64decode(cached["content"])
+            response.from_cache = True
+            return response
+
+        response.from_cache = False
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+
+        if response.status_code == 200 and (etag or last_modified):
+            write_cache(
+                HTTP_CACHE,
+                key,
+                {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "status": response.status_code,
+                    "headers": {
+                        name: value
+                        for name, value in response.headers.items()
+                        if name.lower() in ("content-type", "link")
+                    },
+                    "content": base64.b64encode(response.content).decode(),
+                },
+            )
+
+        return response
+
+
+def get_adapter(max_retries=None):
+    retry = max_retries or Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUSES,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+
+    return CachingAdapter(
+        pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry
+    )
+
+
+@lru_cache(maxsize=None)
+def get_session():
+    """
+    Returns a process-wide `requests.Session` shared by all commands.
+
+    Connections are kept alive and pooled, so concurrent requests against the
+    same host reuse sockets instead of negotiating TLS every time. Transient
+    errors are retried with exponential backoff, and the last response is
+    returned (instead of raised) so callers can still report the status code.
+    GET responses are cached on disk and revalidated with conditional requests.
+    """
+    adapter = get_adapter()
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
@@ -1,10 +1,117 @@
-import requests
+import base64
+import json
+import time
+from functools import lru_cache
 
+import boto3
+
+from .cache import read_cache, write_cache
+from .github_api import GITHUB_API_URL, github_request
+from .http import get_session
+
+ENCRYPTION_KEY_ID = "alias/iac-secret-key"
+
+ENCRYPTED_CREDENTIALS_CACHE = "encrypted-credentials"
+ENCRYPTED_CREDENTIALS_TTL = 15 * 60
+CREDENTIALS_EXPIRY_MARGIN = 5 * 60
+
+
+def check_if_sandbox_exists(org, sandbox_id, token=None):
+    """
+    Checks whether a sandbox is staged. With a token, the answer comes from the
+    sandbox index, so checking many IDs costs a single request.
+    """
+    if token:
+        return sandbox_id in get_sandbox_index(org, token)
 
-def check_if_sandbox_exists(org, sandbox_id):
     url = f"https://raw.githubusercontent.com/{org}/releases/master/staging/{sandbox_id}.yaml"  # noqa: E501
 
-    s = requests.Session()
-    r = s.get(url)
+    r = get_session().get(url)
 
     return 200 <= r.status_code < 300
+
+
+def list_sandboxes(org, token):
+    """
+    Returns the IDs of all sandboxes currently staged, as found in the `staging`
+    folder of the `releases` repository. The folder is read with a single tree
+    request, which is cached and revalidated with its ETag.
+    """
+    r = github_request(
+        "GET", f"{GITHUB_API_URL}/repos/{org}/releases/git/trees/master:staging", token
+    )
+    r.raise_for_status()
+
+    return sorted(
+        entry["path"][: -len(".yaml")]
+        for entry in r.json()["tree"]
+        if entry["type"] == "blob" and entry["path"].endswith(".yaml")
+    )
+
+
+@lru_cache(maxsize=None)
+def get_sandbox_index(org, token):
+    return frozenset(list_sandboxes(org, token))
+
+
+def _credentials_expiry(credentials):
+    # Only temporary credentials (e.g. from SSO or an assumed role) expire.
+    expiry = getattr(credentials, "_expiry_time", None)
+    return expiry.timestamp() if expiry else None
+
+
+def encrypt_credentials(token):
+    """
+    Encrypts the AWS credentials of the current session and the GitHub token
+    with the `iac` KMS key, so they can be passed to the staging workflows.
+
+    The encrypted blob is cached for a few minutes under a hash of the credentials,
+    so back-to-back runs skip KMS. Rotated credentials miss the cache, and entries
+    never outlive temporary credentials.
+    """
+
+    # get (secret) access keys
+    session = boto3.Session()
+    credentials = session.get_credentials()
+    expires_at = _credentials_expiry(credentials)
+    frozen_credentials = credentials.get_frozen_credentials()
+
+    credentials = {
+        "access_key": frozen_credentials.access_key,
+        "secret_key": frozen_credentials.secret_key,
+        "github_api_token": token,
+    }
+
+    cache_key = json.dumps(
+        [
+            credentials,
+            frozen_credentials.token,
+            session.region_name,
+            ENCRYPTION_KEY_ID,
+        ]
+    )
+
+    cached = read_cache(
+        ENCRYPTED_CREDENTIALS_CACHE, cache_key, ENCRYPTED_CREDENTIALS_TTL
+    )
+    if cached and (cached["expires_at"] is None or cached["expires_at"] > time.time()):
+        return cached["secrets"]
+
+    # encrypt (secret) access keys
+    kms = session.client("kms")
+    secrets = kms.encrypt(
+        KeyId=ENCRYPTION_KEY_ID, Plaintext=json.dumps(credentials).encode()
+    )
+    secrets = base64.b64encode(secrets["CiphertextBlob"]).decode()
+
+    if expires_at is not None:
+        # Leave time for the workflow to use the credentials before they expire.
+        expires_at -= CREDENTIALS_EXPIRY_MARGIN
+
+    write_cache(
+        ENCRYPTED_CREDENTIALS_CACHE,
+        cache_key,
+        {"secrets": secrets, "expires_at": expires_at},
+    )
+
+    return secrets
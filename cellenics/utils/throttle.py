@@ -0,0 +1,55 @@
+import re
+import threading
+import time
+
+import click
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+class TokenBucket:
+    """
+    A token bucket shared by any number of threads. On average, at most `rate`
+    tokens are consumed per second, with bursts of up to `capacity` tokens.
+
+    Callers reserve their tokens up front and sleep until they are available,
+    so a caller asking for more than the bucket holds waits its turn instead of
+    starving.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= amount
+
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+
+def parse_size(ctx, param, value):
+    """
+    Click callback parsing sizes like `500K`, `10M` or `1G` into bytes.
+    """
+    if value is None:
+        return None
+
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*", str(value), re.I)
+
+    if not match:
+        raise click.BadParameter("must be a number of bytes, e.g. 500K, 10M or 1G")
+
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
@@ -0,0 +1,215 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+
+from tabulate import tabulate
+
+Span = namedtuple(
+    "Span", ["category", "name", "start", "duration", "thread", "args", "error"]
+)
+
+_spans = []
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+_enabled = False
+_trace_file = None
+
+
+def enable(trace_file=None):
+    """
+    Starts recording spans for the rest of the process. A summary table is
+    printed to stderr on exit and, if `trace_file` is given, every span is
+    written to it: as JSON lines if it ends in `.jsonl`, otherwise in the
+    Chrome trace format (open it in chrome://tracing or https://ui.perfetto.dev).
+    """
+    global _enabled, _trace_file
+
+    if not _enabled:
+        atexit.register(report)
+
+    _enabled = True
+    _trace_file = trace_file
+
+
+def is_enabled():
+    return _enabled
+
+
+def _record(category, name, start, args, error):
+    end = time.perf_counter()
+
+    with _lock:
+        _spans.append(
+            Span(
+                category,
+                name,
+                start - _origin,
+                end - start,
+                threading.get_ident(),
+                args,
+                error,
+            )
+        )
+
+
+@contextmanager
+def span(category, name, **args):
+    """
+    Records how long the body of the `with` statement takes. Keyword arguments
+    are stored with the span in the trace file, and more can be added to the
+    dictionary bound by `as`.
+    """
+    if not _enabled:
+        yield args
+        return
+
+    start = time.perf_counter()
+    error = None
+
+    try:
+        yield args
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _record(category, name, start, args, error)
+
+
+def traced(category, name=None):
+    """
+    Decorator recording a span for every call to the decorated function.
+    """
+
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(category, span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _before_call(model, context, **kwargs):
+    context["trace"] = (
+        model.service_model.service_name,
+        model.name,
+        time.perf_counter(),
+    )
+
+
+def _after_call(context, http_response=None, exception=None, **kwargs):
+    if "trace" not in context:
+        return
+
+    service, operation, start = context.pop("trace")
+
+    error = None
+    if exception is not None:
+        error = type(exception).__name__
+    elif http_response is not None and http_response.status_code >= 300:
+        error = f"HTTP {http_response.status_code}"
+
+    _record(service, operation, start, {}, error)
+
+
+def trace_client(client):
+    """
+    Records a span for every API call made with the boto3 `client`.
+    Returns the client so it can wrap the call that creates it.
+    """
+    if _enabled:
+        client.meta.events.register("before-call.*.*", _before_call)
+        client.meta.events.register("after-call.*.*", _after_call)
+        client.meta.events.register("after-call-error.*.*", _after_call)
+
+    return client
+
+
+def _summary():
+    totals = {}
+
+    for s in _spans:
+        calls, total, longest, errors = totals.get((s.category, s.name), (0, 0, 0, 0))
+        totals[(s.category, s.name)] = (
+            calls + 1,
+            total + s.duration,
+            max(longest, s.duration),
+            errors + (s.error is not None),
+        )
+
+    rows = [
+        (
+            category,
+            name,
+            calls,
+            errors,
+            f"{total:.3f}",
+            f"{total / calls * 1e3:.1f}",
+            f"{longest * 1e3:.1f}",
+        )
+        for (category, name), (calls, total, longest, errors) in sorted(
+            totals.items(), key=lambda item: item[1][1], reverse=True
+        )
+    ]
+
+    return tabulate(
+        rows,
+        headers=[
+            "CATEGORY",
+            "NAME",
+            "CALLS",
+            "ERRORS",
+            "TOTAL (s)",
+            "MEAN (ms)",
+            "MAX (ms)",
+        ],
+    )
+
+
+def _write_trace_file(path):
+    pid = os.getpid()
+
+    with open(path, "w") as f:
+        if path.endswith(".jsonl"):
+            for s in _spans:
+                f.write(json.dumps(s._asdict()) + "\n")
+            return
+
+        events = [
+            {
+                "name": s.name,
+                "cat": s.category,
+                "ph": "X",
+                "ts": s.start * 1e6,
+                "dur": s.duration * 1e6,
+                "pid": pid,
+                "tid": s.thread,
+                "args": dict(s.args, error=s.error) if s.error else s.args,
+            }
+            for s in _spans
+        ]
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def report():
+    with _lock:
+        elapsed = time.perf_counter() - _origin
+
+        print(file=sys.stderr)
+        print(f"Profile ({elapsed:.3f}s total):", file=sys.stderr)
+        print(_summary() if _spans else "No spans recorded.", file=sys.stderr)
+
+        if _trace_file:
+            _write_trace_file(_trace_file)
+            print(f"Trace written to {_trace_file}", file=sys.stderr)
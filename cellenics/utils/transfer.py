@@ -0,0 +1,249 @@
+import json
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+import click
+from tabulate import tabulate
+
+from .throttle import TokenBucket
+
+# How often the progress line is redrawn, and over how many seconds the rate it
+# shows is averaged.
+REFRESH_INTERVAL = 0.5
+RATE_WINDOW = 5
+
+# Slowest transfers listed per bucket in the summary.
+STRAGGLERS = 3
+
+_bandwidth_limit = None
+
+
+def format_bytes(num_bytes):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+    return f"{num_bytes:.1f} TiB"
+
+
+class _Transfer:
+    def __init__(self, direction, bucket, key, size):
+        self.direction = direction
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.transferred = 0
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    @property
+    def seconds(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def to_dict(self):
+        return {
+            "direction": self.direction,
+            "bucket": self.bucket,
+            "key": self.key,
+            "bytes": self.transferred,
+            "seconds": round(self.seconds, 3),
+            "bytes_per_second": round(self.transferred / max(self.seconds, 1e-9)),
+            "error": self.error,
+        }
+
+
+class TransferMetrics:
+    """
+    Aggregates the progress of S3 transfers, which may run concurrently.
+
+    Every transfer registered with `track` feeds the live progress line, which
+    is only shown when stderr is a terminal, and the summary printed by `report`.
+    """
+
+    def __init__(self, stream=sys.stderr):
+        self._stream = stream
+        self._live = stream.isatty()
+        self._lock = threading.Lock()
+        self._transfers = []
+        self._samples = deque()
+        self._transferred = 0
+        self._last_render = 0
+
+    @contextmanager
+    def track(self, direction, bucket, key, size):
+        """
+        Registers a transfer of `size` bytes and yields the callback to pass as
+        `Callback` to boto3.
+        """
+        transfer = _Transfer(direction, bucket, key, size)
+
+        with self._lock:
+            self._transfers.append(transfer)
+
+        def callback(num_bytes):
+            with self._lock:
+                transfer.transferred += num_bytes
+                self._transferred += num_bytes
+                self._render()
+
+            # Callbacks run as data is read, so waiting here slows the transfer.
+            if _bandwidth_limit:
+                _bandwidth_limit.consume(num_bytes)
+
+        try:
+            yield callback
+        except BaseException as e:
+            transfer.error = type(e).__name__
+            raise
+        finally:
+            with self._lock:
+                transfer.end = time.perf_counter()
+                self._render(force=True)
+
+    def _rate(self, now):
+        self._samples.append((now, self._transferred))
+
+        while now - self._samples[0][0] > RATE_WINDOW:
+            self._samples.popleft()
+
+        start, transferred = self._samples[0]
+        return (self._transferred - transferred) / max(now - start, 1e-9)
+
+    def _render(self, force=False):
+        now = time.perf_counter()
+        rate = self._rate(now)
+
+        if not self._live or (not force and now - self._last_render < REFRESH_INTERVAL):
+            return
+
+        self._last_render = now
+
+        done = sum(1 for t in self._transfers if t.end is not None)
+        in_flight = len(self._transfers) - done
+        total = sum(max(t.size, t.transferred) for t in self._transfers)
+
+        eta = f"{(total - self._transferred) / rate:.0f}s" if rate else "-"
+
+        self._stream.write(
+            f"\r\033[K{done}/{len(self._transfers)} objects ({in_flight} in flight), "
+            f"{format_bytes(self._transferred)}/{format_bytes(total)}, "
+            f"{format_bytes(rate)}/s, ETA {eta}"
+        )
+        self._stream.flush()
+
+    def summary(self):
+        """
+        Returns the totals of all transfers so far, and per bucket, as a
+        JSON-serializable dictionary.
+        """
+        with self._lock:
+            transfers = list(self._transfers)
+
+        buckets = {}
+        for transfer in transfers:
+            buckets.setdefault(transfer.bucket, []).append(transfer)
+
+        def totals(transfers):
+            start = min(t.start for t in transfers)
+            end = max(t.end or time.perf_counter() for t in transfers)
+            num_bytes = sum(t.transferred for t in transfers)
+
+            return {
+                "objects": len(transfers),
+                "errors": sum(1 for t in transfers if t.error),
+                "bytes": num_bytes,
+                "seconds": round(end - start, 3),
+                "bytes_per_second": round(num_bytes / max(end - start, 1e-9)),
+            }
+
+        return {
+            **(totals(transfers) if transfers else {"objects": 0, "bytes": 0}),
+            "buckets": {
+                bucket: {
+                    **totals(bucket_transfers),
+                    "slowest": [
+                        t.to_dict()
+                        for t in sorted(
+                            bucket_transfers, key=lambda t: t.seconds, reverse=True
+                        )[:STRAGGLERS]
+                    ],
+                }
+                for bucket, bucket_transfers in buckets.items()
+            },
+            "transfers": [t.to_dict() for t in transfers],
+        }
+
+    def report(self, metrics_file=None):
+        """
+        Prints the throughput per bucket and, if `metrics_file` is given, writes
+        the full summary to it as JSON.
+        """
+        summary = self.summary()
+
+        if not summary["objects"]:
+            return
+
+        if self._live:
+            self._stream.write("\n")
+
+        rows = [
+            (
+                bucket,
+                totals["objects"],
+                totals["errors"],
+                format_bytes(totals["bytes"]),
+                totals["seconds"],
+                f"{format_bytes(totals['bytes_per_second'])}/s",
+            )
+            for bucket, totals in summary["buckets"].items()
+        ]
+
+        click.echo()
+        click.echo(
+            tabulate(
+                rows,
+                headers=["BUCKET", "OBJECTS", "ERRORS", "SIZE", "SECONDS", "RATE"],
+            )
+        )
+
+        if metrics_file:
+            with open(metrics_file, "w") as f:
+                json.dump(summary, f, indent=2)
+
+            click.echo(f"Transfer metrics written to {metrics_file}")
+
+
+def limit_transfers(s3_client, max_bandwidth=None, max_requests=None):
+    """
+    Throttles every S3 transfer in the process to `max_bandwidth` bytes per
+    second in total, and the requests made with `s3_client` to `max_requests`
+    per second.
+    """
+    global _bandwidth_limit
+
+    if max_bandwidth:
+        _bandwidth_limit = TokenBucket(max_bandwidth)
+
+    if max_requests:
+        request_limit = TokenBucket(max_requests)
+
+        # Handlers returning anything but None would replace the request.
+        def before_send(**kwargs):
+            request_limit.consume()
+
+        s3_client.meta.events.register("before-send.s3", before_send)
+
+
+@lru_cache(maxsize=None)
+def get_transfer_metrics():
+    """
+    Returns the process-wide `TransferMetrics` all S3 transfers report to.
+    """
+    return TransferMetrics()